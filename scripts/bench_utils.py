@@ -0,0 +1,99 @@
+"""
+Benchmarks for list helpers in utils (dedup and chunking)
+
+Usage :: python bench_utils.py -s 1000,10000,100000
+"""
+import time
+import tracemalloc
+from optparse import OptionParser
+
+import numpy as np
+
+from utils import remove_duplicates, divide_into_chunks, iter_chunks, flatten, iter_flatten
+
+
+def remove_duplicates_quadratic(any_list):
+    """Previous list based implementation of `remove_duplicates` (baseline)
+    """
+    final_list = list()
+    for item in any_list:
+        if item not in final_list:
+            final_list.append(item)
+    return final_list
+
+
+def time_it(func, *args, repeat=3):
+    """Best wall time (seconds) of `repeat` calls
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def peak_memory(func, *args):
+    """Peak memory (bytes) allocated by python while running func
+    """
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def bench_dedup(sizes, max_quadratic_size=20000):
+    print("remove_duplicates (half of the items are duplicates)")
+    print("{:>10} {:>12} {:>12} {:>12}".format('n', 'hashable', 'unhashable', 'quadratic'))
+    for n in sizes:
+        items = np.random.randint(0, n // 2 + 1, n).tolist()
+        unhashable = [[x] for x in items]
+        quadratic = 'skipped'
+        if n <= max_quadratic_size:
+            quadratic = '{:.4f}'.format(time_it(remove_duplicates_quadratic, items, repeat=1))
+        print("{:>10} {:>12.4f} {:>12.4f} {:>12}".format(n, time_it(remove_duplicates, items),
+                                                       time_it(remove_duplicates, unhashable), quadratic))
+
+
+def bench_chunks(sizes, chunk_size=1000):
+    print("\nchunking a float64 array, iterating over all chunks")
+    print("{:>10} {:>12} {:>12} {:>14} {:>14}".format('n', 'list (s)', 'lazy (s)', 'list peak (B)', 'lazy peak (B)'))
+    for n in sizes:
+        array = np.random.rand(n)
+
+        def eager():
+            for chunk in divide_into_chunks(array.tolist(), chunk_size):
+                pass
+
+        def lazy():
+            for chunk in iter_chunks(array, chunk_size):
+                pass
+
+        print("{:>10} {:>12.4f} {:>12.4f} {:>14} {:>14}".format(n, time_it(eager), time_it(lazy), peak_memory(eager),
+                                                               peak_memory(lazy)))
+
+    print("\nflattening a generator of lists, summing the items")
+    print("{:>10} {:>12} {:>12} {:>14} {:>14}".format('n', 'list (s)', 'lazy (s)', 'list peak (B)', 'lazy peak (B)'))
+    for n in sizes:
+        def lists():
+            return ([i] * 10 for i in range(n // 10))
+
+        def eager():
+            return sum(flatten(lists()))
+
+        def lazy():
+            return sum(iter_flatten(lists()))
+
+        print("{:>10} {:>12.4f} {:>12.4f} {:>14} {:>14}".format(n, time_it(eager), time_it(lazy), peak_memory(eager),
+                                                               peak_memory(lazy)))
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-s", "--sizes", dest="sizes", default="1000,10000,100000,1000000")
+    parser.add_option("-q", "--max-quadratic", dest="max_quadratic", default="20000")
+    (options, args) = parser.parse_args()
+    sizes = [int(x) for x in options.sizes.split(',')]
+    bench_dedup(sizes, int(options.max_quadratic))
+    bench_chunks(sizes)
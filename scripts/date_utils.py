@@ -4,6 +4,9 @@ from optparse import OptionParser
 from datetime import datetime
 from datetime import timedelta
 import calendar
+from collections.abc import Mapping
+
+import numpy as np
 
 
 Holidays_exchange = ['20190304','20190321','20190417','20190419','20190429','20190501','20190605',
@@ -23,27 +26,13 @@ HOLIDAYS_B3 = ['20220101', '20220228', '20220301', '20220302', '20220415', '2022
 HOLIDAYS_B3 += ['20230220', '20230221', '20230407', '20230421', '20230501', '20230608',
                 '20230907', '20231012',' 20231102', '20231115', '20231225', '20231229']               
 
-EXCH_HOLIDAY_MAP = dict()
-for _exch in ['NSECM', 'NSEFO', 'NSECD', 'BSECM', 'BSECD']:
-    EXCH_HOLIDAY_MAP[_exch] = Holidays_exchange
-for _exch in ['B3FO', 'b3fo', 'B3CD', 'b3cd', 'B3', 'b3']:
-    EXCH_HOLIDAY_MAP[_exch] = HOLIDAYS_B3
-
 
 def get_cl_formatted_date(date):
     return date[0:4] + '-' + date[4:6]+ '-' + date[6:] + '  00:00:00'
 
 
 def get_implied_weekly_for_monthly_expiry(date):
-    monthly_expiry = get_nsefo_monthly_expiry_date(date)
-    count = 0
-    curr_date = date
-    while curr_date != monthly_expiry:
-        curr_date = get_nsefo_weekly_expiry_date(curr_date)
-        if curr_date != monthly_expiry:
-            curr_date = get_next_date(curr_date)
-            count += 1
-    return f"W.{count}"
+    return get_expiry_schedule().implied_weekly(date)
 
 def convert_bhav_date_to_readable(date):
     day = date.split('-')[0]
@@ -92,27 +81,7 @@ def get_nsefo_monthly_expiry_date(date, holidays=Holidays_exchange):
     Returns:
         str : Expiry date in YYYYMMDD format
     """
-    last_thursday = get_dates_of_weekday(date[:4], date[4:6], 'thursday')[-1]
-    
-    if date > last_thursday:
-        curr_month_num = int(date[4:6])
-        curr_year = int(date[:4])
-        
-        if curr_month_num == 12:
-            next_month_num = 1
-            next_year_num = curr_year + 1
-        else:
-            next_month_num = curr_month_num + 1
-            next_year_num = curr_year
-        next_month = f"{next_month_num:02d}"
-        next_year = f"{next_year_num}"
-
-        last_thursday = get_dates_of_weekday(next_year, next_month, 'thursday')[-1]
-    
-    if last_thursday in holidays:
-        return get_prev_working_day(last_thursday, holidays)
-    else:
-        return last_thursday
+    return get_expiry_schedule(holidays).monthly(date)
 
 
 def get_nsefo_prev_monthly_expiry_date(date, holidays=Holidays_exchange):
@@ -125,22 +94,7 @@ def get_nsefo_prev_monthly_expiry_date(date, holidays=Holidays_exchange):
     Returns:
         str : Expiry date in YYYYMMDD format
     """
-    curr_monthly_expiry_date = get_nsefo_monthly_expiry_date(date, holidays)
-    curr_date = curr_monthly_expiry_date
-    count = 0
-    while True:
-        count += 1
-        prev_working_date = get_prev_working_day(curr_date)
-        if curr_monthly_expiry_date != get_nsefo_monthly_expiry_date(prev_working_date, holidays):
-            return get_nsefo_monthly_expiry_date(prev_working_date, holidays)
-        else:
-            curr_date = prev_working_date
-        
-        if count >= 60:
-            print("Could not find prev monthly expiry!")
-            return None
-            
-    return
+    return get_expiry_schedule(holidays).prev_monthly(date)
 
     
 def get_nsefo_weekly_expiry_date(date, holidays=Holidays_exchange):
@@ -153,29 +107,7 @@ def get_nsefo_weekly_expiry_date(date, holidays=Holidays_exchange):
     Returns:
         str : Expiry date in YYYYMMDD format
     """
-    next_thursdays = [x for x in get_dates_of_weekday(date[:4], date[4:6], 'thursday') if x >= date]
-    
-    if len(next_thursdays) == 0:
-        curr_month_num = int(date[4:6])
-        curr_year = int(date[:4])
-        
-        if curr_month_num == 12:
-            next_month_num = 1
-            next_year_num = curr_year + 1
-        else:
-            next_month_num = curr_month_num + 1
-            next_year_num = curr_year
-        next_month = f"{next_month_num:02d}"
-        next_year = f"{next_year_num}"
-        
-        next_thursday = get_dates_of_weekday(next_year, next_month, 'thursday')[0]
-    else:
-        next_thursday = next_thursdays[0]
-
-    if next_thursday in holidays:
-        return get_prev_working_day(next_thursday, holidays)
-    else:
-        return next_thursday
+    return get_expiry_schedule(holidays).weekly(date)
 
 
 def get_todays_date():
@@ -194,29 +126,25 @@ def get_next_date(date):
 def get_weekday_name(date):
     return calendar.day_name[datetime.strptime(date, "%Y%m%d").weekday()]
 
+_UNKNOWN_EXCHANGES = set()
+
+
 def get_holidays( exchange ):
-    return EXCH_HOLIDAY_MAP.get(exchange, Holidays_exchange)
+    """Holidays (YYYYMMDD strings) of a registered calendar, NSE holidays for unknown exchanges
+    """
+    cal = _CALENDAR_REGISTRY.get(exchange.strip().upper())
+    if cal is not None:
+        return cal.holiday_list
+    if exchange not in _UNKNOWN_EXCHANGES:
+        _UNKNOWN_EXCHANGES.add(exchange)
+        print("No holiday calendar registered for '{}', using NSE holidays".format(exchange))
+    return Holidays_exchange
 
 def get_next_working_day( date, holidays=Holidays_exchange):
-    next_day = datetime.strptime( date, "%Y%m%d" )
-    while True:
-        next_day += timedelta(days=1)
-        if next_day.weekday() >=5:
-            continue
-        if next_day.strftime("%Y%m%d") in holidays:
-            continue
-        return next_day.strftime("%Y%m%d")
+    return get_trading_calendar(holidays).next(date)
 
 def get_prev_working_day( date, holidays=Holidays_exchange):
-    prev_day = datetime.strptime(date, "%Y%m%d" )
-    while True:
-        prev_day -= timedelta(days=1)
-        if prev_day.weekday() >=5:
-            continue
-        if prev_day.strftime("%Y%m%d") in holidays:
-            continue
-        return prev_day.strftime("%Y%m%d")
-    return "-1"
+    return get_trading_calendar(holidays).prev(date)
 
 
 def convert_date_to_bhav_style(date):
@@ -228,42 +156,629 @@ def convert_date_to_bhav_style(date):
 
 
 def get_working_days(start_date, end_date, num_days, exchange, weekday=""):
-    holidays = get_holidays( exchange )
+    if isinstance(exchange, TradingCalendar):
+        cal = exchange
+    else:
+        cal = get_trading_calendar(get_holidays( exchange ))
     days = []
     if( start_date != "-1" and end_date != "-1" ):
-        start_date = get_prev_working_day(start_date, holidays)
-        end_date = get_next_working_day(end_date, holidays)
-        end_date = get_prev_working_day(end_date, holidays)
-        while( start_date != end_date ):
-            start_date = get_next_working_day(start_date, holidays)
-            days.append(start_date)
+        start_date = cal.prev(start_date)
+        end_date = cal.prev(cal.next(end_date))
+        if start_date != end_date:
+            days += cal.range(cal.next(start_date), end_date).tolist()
+        start_date = end_date
     if( start_date != "-1" and num_days != "-1" ):
-        start_date = get_prev_working_day(start_date, holidays)
-        for num in range(int(num_days)):
-            start_date = get_next_working_day(start_date, holidays)
-            days.append(start_date)
+        start_date = cal.prev(start_date)
+        days += cal.next(np.repeat(start_date, int(num_days)), np.arange(1, int(num_days) + 1)).tolist()
     if( end_date != "-1" and num_days != "-1" ):
-        end_date = get_next_working_day(end_date, holidays)
-        for num in range(int(num_days)):
-            end_date = get_prev_working_day(end_date, holidays)
-            days.insert(0,end_date)
+        end_date = cal.next(end_date)
+        days = cal.prev(np.repeat(end_date, int(num_days)), np.arange(int(num_days), 0, -1)).tolist() + days
 
     if weekday == "":
         return days
     else:
         return [day for day in days if get_weekday_name(day).lower() == weekday.strip().lower()]
 
+
+
+def parse_dates(dates):
+    """Parse YYYYMMDD strings (or ints) into datetime64[D], all at once
+
+    Args:
+        dates (str or array-like): YYYYMMDD strings/ints, or datetime64 values
+
+    Returns:
+        np.ndarray or np.datetime64: datetime64[D] value(s), same shape as input
+
+    Raises:
+        ValueError: For dates which do not exist (e.g. 20230231)
+    """
+    arr = np.asarray(dates)
+    if np.issubdtype(arr.dtype, np.datetime64):
+        return arr.astype('datetime64[D]')
+    if arr.dtype.kind in 'UO':
+        arr = np.char.strip(arr.astype(str))
+    ints = arr.astype(np.int64)
+    month, day = ints // 100 % 100, ints % 100
+    years = (ints // 10000 - 1970).astype('datetime64[Y]')
+    months = years.astype('datetime64[M]') + (month - 1)
+    parsed = months.astype('datetime64[D]') + (day - 1)
+    # Out of range days roll over into the next month(s) instead of failing
+    invalid = (month < 1) | (month > 12) | (day < 1) | (parsed.astype('datetime64[M]') != months)
+    if np.any(invalid):
+        raise ValueError("Invalid YYYYMMDD date(s): {}".format(np.atleast_1d(arr)[np.atleast_1d(invalid)][:5].tolist()))
+    return parsed
+
+
+def format_dates(dates):
+    """Format datetime64 values as YYYYMMDD strings (inverse of `parse_dates`)
+    """
+    dates = np.asarray(dates).astype('datetime64[D]')
+    months = dates.astype('datetime64[M]')
+    years = months.astype('datetime64[Y]').astype(np.int64) + 1970
+    ints = years * 10000 + (months.astype(np.int64) % 12 + 1) * 100 + (dates - months).astype(np.int64) + 1
+    return ints.astype(str)
+
+
+class TradingCalendar(object):
+    """Business days of an exchange, precomputed as a sorted datetime64[D] array
+
+    All queries are searchsorted/index arithmetic on that array and accept a
+    single date or arrays of dates (YYYYMMDD strings or datetime64). Results have
+    the type of the input: strings in, strings out. The covered range grows
+    automatically when dates outside of it are queried.
+
+    Open days are also kept as a bitset (bool array indexed by days since the
+    start of the range), so `is_business_day` is O(1) per date. Calendars of
+    cross-listed instruments are combined with `union` (closed if any exchange
+    is closed) and `intersection` (closed only if all exchanges are closed).
+
+    Example:
+        cal = TradingCalendar(Holidays_exchange)
+        cal.next('20230404')                  # '20230405'
+        cal.shift(df['date'].values, -2)      # two business days before each date
+    """
+
+    def __init__(self, holidays, start_year=2000, end_year=2040, weekmask='1111100'):
+        holidays = [x for x in holidays if str(x).strip()]
+        self.holidays = np.unique(parse_dates(holidays)) if holidays else np.array([], dtype='datetime64[D]')
+        self.holiday_list = format_dates(self.holidays).tolist()
+        self.holiday_set = frozenset(self.holiday_list)
+        self.weekmask = weekmask
+        self.start_year = self.end_year = None
+        self._build(start_year, end_year)
+
+    def _build(self, start_year, end_year):
+        self.origin = np.datetime64(f'{start_year}-01-01')
+        days = np.arange(self.origin, np.datetime64(f'{end_year + 1}-01-01'), dtype='datetime64[D]')
+        self.open_mask = np.is_busday(days, weekmask=self.weekmask, holidays=self.holidays)
+        self.business_days = days[self.open_mask]
+        self.start_year, self.end_year = start_year, end_year
+        self._day_positions = None
+
+    def _scalar_lookup(self):
+        """{YYYYMMDD: (business days before it, business days up to it)} and business days as strings
+
+        Built on first use, lets `next`/`prev` of a single string skip numpy parsing and formatting.
+        """
+        if self._day_positions is None:
+            days = np.arange(self.origin, np.datetime64(f'{self.end_year + 1}-01-01'), dtype='datetime64[D]')
+            before = np.searchsorted(self.business_days, days, side='left')
+            self._day_positions = dict(zip(format_dates(days).tolist(),
+                                           zip(before.tolist(), (before + self.open_mask).tolist())))
+            self._business_day_list = format_dates(self.business_days).tolist()
+        return self._day_positions, self._business_day_list
+
+    def union(self, *others):
+        """Calendar open only on days all calendars are open (holidays of any of them)
+        """
+        calendars = (self,) + others
+        holidays = np.unique(np.concatenate([cal.holidays for cal in calendars]))
+        weekmask = ''.join('1' if all(day == '1' for day in days) else '0'
+                           for days in zip(*[cal.weekmask for cal in calendars]))
+        return TradingCalendar(holidays, self.start_year, self.end_year, weekmask)
+
+    def intersection(self, *others):
+        """Calendar open on days any calendar is open (holidays common to all of them)
+        """
+        calendars = (self,) + others
+        holidays = calendars[0].holidays
+        for cal in calendars[1:]:
+            holidays = np.intersect1d(holidays, cal.holidays)
+        weekmask = ''.join('1' if any(day == '1' for day in days) else '0'
+                           for days in zip(*[cal.weekmask for cal in calendars]))
+        return TradingCalendar(holidays, self.start_year, self.end_year, weekmask)
+
+    def is_holiday(self, date):
+        """Check if a YYYYMMDD date is in the holiday list (hashed lookup)
+        """
+        return date.strip() in self.holiday_set
+
+    def _ensure_range(self, dates, margin=1):
+        if not dates.size:
+            return
+        years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+        start_year = min(self.start_year, int(years.min()) - margin)
+        end_year = max(self.end_year, int(years.max()) + margin)
+        if (start_year, end_year) != (self.start_year, self.end_year):
+            self._build(start_year, end_year)
+
+    def _prepare(self, dates):
+        arr = np.asarray(dates)
+        as_string = not np.issubdtype(arr.dtype, np.datetime64)
+        parsed = parse_dates(arr)
+        self._ensure_range(parsed)
+        return parsed, as_string
+
+    @staticmethod
+    def _output(result, as_string):
+        if as_string:
+            result = format_dates(result)
+        result = np.asarray(result)
+        if result.ndim:
+            return result
+        return str(result) if as_string else result[()]
+
+    def is_business_day(self, dates):
+        dates, _ = self._prepare(dates)
+        result = self.open_mask[(dates - self.origin).astype(np.int64)]
+        return result[()] if np.ndim(result) == 0 else result
+
+    def next(self, dates, n=1):
+        """n-th business day strictly after each date
+        """
+        if isinstance(dates, str) and isinstance(n, int):
+            positions, business_days = self._scalar_lookup()
+            position = positions.get(dates)
+            if position is not None and 0 <= position[1] + n - 1 < len(business_days):
+                return business_days[position[1] + n - 1]
+        dates, as_string = self._prepare(dates)
+        idx = np.searchsorted(self.business_days, dates, side='right') + np.asarray(n) - 1
+        if np.any(idx >= len(self.business_days)):
+            self._build(self.start_year, self.end_year + 1 + int(np.max(n)) // 250)
+            return self.next(self._output(dates, as_string), n)
+        return self._output(self.business_days[idx], as_string)
+
+    def prev(self, dates, n=1):
+        """n-th business day strictly before each date
+        """
+        if isinstance(dates, str) and isinstance(n, int):
+            positions, business_days = self._scalar_lookup()
+            position = positions.get(dates)
+            if position is not None and 0 <= position[0] - n < len(business_days):
+                return business_days[position[0] - n]
+        dates, as_string = self._prepare(dates)
+        idx = np.searchsorted(self.business_days, dates, side='left') - np.asarray(n)
+        if np.any(idx < 0):
+            self._build(self.start_year - 1 - int(np.max(n)) // 250, self.end_year)
+            return self.prev(self._output(dates, as_string), n)
+        return self._output(self.business_days[idx], as_string)
+
+    def shift(self, dates, n):
+        """Move each date by n business days (n < 0 moves back, n == 0 keeps the date)
+        """
+        n = np.asarray(n)
+        if not n.any():
+            return dates
+        if (n >= 0).all():
+            return np.where(n == 0, dates, self.next(dates, np.maximum(n, 1))) if n.ndim else self.next(dates, n)
+        if (n <= 0).all():
+            return np.where(n == 0, dates, self.prev(dates, np.maximum(-n, 1))) if n.ndim else self.prev(dates, -n)
+        return np.where(n > 0, self.next(dates, np.maximum(n, 1)),
+                        np.where(n < 0, self.prev(dates, np.maximum(-n, 1)), dates))
+
+    def range(self, start_date, end_date):
+        """Business days between start_date and end_date (both inclusive)
+        """
+        (start, end), as_string = self._prepare([start_date, end_date])
+        days = self.business_days[np.searchsorted(self.business_days, start, side='left'):
+                                  np.searchsorted(self.business_days, end, side='right')]
+        return self._output(days, as_string)
+
+    def count(self, start_date, end_date):
+        """Number of business days between start_date and end_date (both inclusive, vectorized)
+        """
+        start, _ = self._prepare(start_date)
+        end, _ = self._prepare(end_date)
+        return (np.searchsorted(self.business_days, end, side='right')
+                - np.searchsorted(self.business_days, start, side='left'))
+
+
+_TRADING_CALENDARS = dict()
+_CALENDAR_REGISTRY = dict()
+
+
+def register_calendar(name, holidays, aliases=(), weekmask='1111100'):
+    """Register the holiday calendar of an exchange (names are case insensitive)
+
+    Args:
+        name (str): Exchange name
+        holidays (list or TradingCalendar): YYYYMMDD holidays, or a ready calendar
+        aliases (list): Other names of the same calendar (e.g. segments of an exchange)
+        weekmask (str): Open weekdays, Monday first
+
+    Returns:
+        TradingCalendar: Registered calendar
+    """
+    if isinstance(holidays, TradingCalendar):
+        cal = holidays
+    else:
+        cal = TradingCalendar(holidays, weekmask=weekmask)
+    for key in (name,) + tuple(aliases):
+        _CALENDAR_REGISTRY[key.strip().upper()] = cal
+    return cal
+
+
+def get_calendar(*names, how='union'):
+    """Get registered calendar of an exchange, or combined calendar of several
+
+    Args:
+        names (str): Registered exchange names
+        how (str): 'union' (open when all are open) or 'intersection' (open when any is open)
+
+    Returns:
+        TradingCalendar: Calendar
+    """
+    calendars = list()
+    for name in names:
+        cal = _CALENDAR_REGISTRY.get(name.strip().upper())
+        if cal is None:
+            raise ValueError("No holiday calendar registered for '{}'. Known: {}".format(name, list_calendars()))
+        calendars.append(cal)
+    if len(calendars) == 1:
+        return calendars[0]
+    if how not in ('union', 'intersection'):
+        raise ValueError("Combination '{}' not supported. Use 'union' or 'intersection'".format(how))
+    return getattr(calendars[0], how)(*calendars[1:])
+
+
+def list_calendars():
+    return sorted(_CALENDAR_REGISTRY)
+
+
+def _read_holiday_file(file_name):
+    """Read {exchange or None: {'holidays': [...], ...}} from a YAML or CSV file
+    """
+    if file_name.endswith(('.yaml', '.yml')):
+        with open(file_name) as f:
+            data = yaml.safe_load(f) or dict()
+        if isinstance(data, list):
+            return {None: dict(holidays=data)}
+        return {name: spec if isinstance(spec, dict) else dict(holidays=spec) for name, spec in data.items()}
+
+    with open(file_name, newline='') as f:
+        rows = [row for row in csv.reader(f) if row and row[0].strip() and not row[0].startswith('#')]
+    header = [x.strip().lower() for x in rows[0]] if rows else []
+    if 'date' not in header:
+        return {None: dict(holidays=[row[0] for row in rows])}
+    date_col = header.index('date')
+    exch_col = header.index('exchange') if 'exchange' in header else None
+    specs = dict()
+    for row in rows[1:]:
+        name = row[exch_col].strip() if exch_col is not None else None
+        specs.setdefault(name, dict(holidays=list()))['holidays'].append(row[date_col])
+    return specs
+
+
+def load_calendars(file_name, name=None):
+    """Load holiday calendars from a file and register them
+
+    YAML files map exchange names to a list of YYYYMMDD holidays or to
+    {holidays: [...], aliases: [...], weekmask: '1111100'}. CSV files have
+    'exchange' and 'date' columns (or just one date per line). Files without
+    exchange names are registered under `name` (default: file name without extension).
+
+    Args:
+        file_name (str): Path to .yaml/.yml or .csv file
+        name (str): Exchange name for files without exchange names
+
+    Returns:
+        list: Registered exchange names
+    """
+    if name is None:
+        name = os.path.splitext(os.path.basename(file_name))[0]
+    names = list()
+    for exchange, spec in _read_holiday_file(file_name).items():
+        exchange = str(exchange if exchange is not None else name)
+        holidays = [str(x) for x in spec.get('holidays') or []]
+        register_calendar(exchange, holidays, spec.get('aliases', ()), spec.get('weekmask', '1111100'))
+        names.append(exchange)
+    return names
+
+
+register_calendar('NSE', Holidays_exchange, ['NSECM', 'NSEFO', 'NSECD', 'BSECM', 'BSECD'])
+register_calendar('B3', HOLIDAYS_B3, ['B3FO', 'B3CD'])
+
+
+class _RegistryHolidays(Mapping):
+    """Read only {exchange: holidays} view of the calendar registry (case insensitive)
+    """
+
+    def __getitem__(self, exchange):
+        if not isinstance(exchange, str):
+            raise KeyError(exchange)
+        return _CALENDAR_REGISTRY[exchange.strip().upper()].holiday_list
+
+    def __iter__(self):
+        return iter(_CALENDAR_REGISTRY)
+
+    def __len__(self):
+        return len(_CALENDAR_REGISTRY)
+
+
+EXCH_HOLIDAY_MAP = _RegistryHolidays()
+
+
+_MAX_CACHED_LISTS = 64
+
+
+def _get_cached(cache, list_cache, holidays, factory):
+    """Get factory(holidays) from cache keyed by the holidays, building it on first use
+
+    Hashing tuple(holidays) costs O(#holidays) per call, so holiday lists are first
+    looked up by identity (the same list, e.g. Holidays_exchange, is passed on every
+    call). The entry keeps a copy of the list so a list changed in place is rehashed.
+    """
+    entry = list_cache.get(id(holidays))
+    if entry is not None and entry[0] is holidays and len(holidays) == len(entry[1]) and holidays == entry[1]:
+        return entry[2]
+    key = tuple(holidays)
+    value = cache.get(key)
+    if value is None:
+        value = factory(holidays)
+        cache[key] = value
+    if isinstance(holidays, list):
+        if len(list_cache) >= _MAX_CACHED_LISTS:
+            list_cache.clear()
+        list_cache[id(holidays)] = (holidays, list(holidays), value)
+    return value
+
+
+_TRADING_CALENDARS_BY_LIST = dict()
+
+
+def get_trading_calendar(holidays=Holidays_exchange):
+    """Get (cached) TradingCalendar for an exchange name or a list of holidays
+    """
+    if isinstance(holidays, str):
+        if holidays.strip().upper() in _CALENDAR_REGISTRY:
+            return get_calendar(holidays)
+        holidays = get_holidays(holidays)
+    return _get_cached(_TRADING_CALENDARS, _TRADING_CALENDARS_BY_LIST, holidays, TradingCalendar)
+
+
+
+class ExpirySchedule(object):
+    """Precomputed NSEFO weekly and monthly expiries for one set of holidays
+
+    Raw expiries are Thursdays (all of them for weekly contracts, the last one
+    of each month for monthly contracts). Expiries falling on a holiday move to
+    the previous working day. A date maps to the first raw expiry on or after
+    it, which is a single searchsorted over the table, so whole columns of
+    dates are mapped at once. The table grows when dates outside of it are queried.
+
+    Example:
+        schedule = get_expiry_schedule(Holidays_exchange)
+        schedule.monthly(df['date'].values)
+    """
+
+    def __init__(self, holidays=Holidays_exchange, start_year=2000, end_year=2040):
+        self.calendar = TradingCalendar(holidays)
+        self.start_year = self.end_year = None
+        self._build(start_year, end_year)
+
+    def _build(self, start_year, end_year):
+        first = np.busday_offset(np.datetime64(f'{start_year}-01-01'), 0, roll='forward', weekmask='0001000')
+        thursdays = np.arange(first, np.datetime64(f'{end_year + 1}-01-01'), np.timedelta64(7, 'D'))
+        months = thursdays.astype('datetime64[M]')
+        last_of_month = np.append(months[1:] != months[:-1], True)
+
+        self.weekly_raw = thursdays
+        self.monthly_raw = thursdays[last_of_month]
+        self.weekly_expiries = self._adjust(self.weekly_raw)
+        self.monthly_expiries = self._adjust(self.monthly_raw)
+        # Position of every monthly expiry in the weekly table (for implied weekly labels)
+        self.monthly_week_index = np.flatnonzero(last_of_month)
+        self.start_year, self.end_year = start_year, end_year
+
+    def _adjust(self, raw):
+        holiday = np.isin(raw, self.calendar.holidays)
+        adjusted = raw.copy()
+        if holiday.any():
+            adjusted[holiday] = self.calendar.prev(raw[holiday])
+        return adjusted
+
+    def _prepare(self, dates):
+        arr = np.asarray(dates)
+        as_string = not np.issubdtype(arr.dtype, np.datetime64)
+        parsed = parse_dates(arr)
+        if parsed.size:
+            years = parsed.astype('datetime64[Y]').astype(np.int64) + 1970
+            start_year = min(self.start_year, int(years.min()) - 1)
+            end_year = max(self.end_year, int(years.max()) + 1)
+            if (start_year, end_year) != (self.start_year, self.end_year):
+                self._build(start_year, end_year)
+        return parsed, as_string
+
+    def weekly(self, dates):
+        """Weekly expiry of each date (next Thursday on or after it, holiday adjusted)
+        """
+        dates, as_string = self._prepare(dates)
+        idx = np.searchsorted(self.weekly_raw, dates, side='left')
+        return TradingCalendar._output(self.weekly_expiries[idx], as_string)
+
+    def monthly(self, dates):
+        """Monthly expiry of each date (next last-Thursday-of-month on or after it, holiday adjusted)
+        """
+        dates, as_string = self._prepare(dates)
+        idx = np.searchsorted(self.monthly_raw, dates, side='left')
+        return TradingCalendar._output(self.monthly_expiries[idx], as_string)
+
+    def prev_monthly(self, dates):
+        """Monthly expiry before the monthly expiry of each date
+        """
+        dates, as_string = self._prepare(dates)
+        idx = np.searchsorted(self.monthly_raw, dates, side='left') - 1
+        return TradingCalendar._output(self.monthly_expiries[idx], as_string)
+
+    def weeks_to_monthly(self, dates):
+        """Number of weekly expiries before the monthly expiry of each date
+        """
+        dates, _ = self._prepare(dates)
+        week_idx = np.searchsorted(self.weekly_raw, dates, side='left')
+        month_idx = np.searchsorted(self.monthly_raw, dates, side='left')
+        return self.monthly_week_index[month_idx] - week_idx
+
+    def implied_weekly(self, dates):
+        """'W.<n>' labels: n weekly expiries remain before the monthly expiry
+        """
+        counts = np.asarray(self.weeks_to_monthly(dates))
+        labels = np.char.add('W.', counts.astype(str))
+        return str(labels) if labels.ndim == 0 else labels
+
+
+_EXPIRY_SCHEDULES = dict()
+_EXPIRY_SCHEDULES_BY_LIST = dict()
+
+
+def get_expiry_schedule(holidays=Holidays_exchange):
+    """Get (cached) ExpirySchedule for an exchange name or a list of holidays
+    """
+    if isinstance(holidays, str):
+        holidays = get_holidays(holidays)
+    return _get_cached(_EXPIRY_SCHEDULES, _EXPIRY_SCHEDULES_BY_LIST, holidays, ExpirySchedule)
+
+
+
+def _map_unique(func, dates):
+    """Apply a vectorized func to the distinct values of dates only and broadcast back
+
+    Date columns repeat the same few thousand days, so parsing/formatting the
+    distinct values is much cheaper than doing it per row.
+    """
+    arr = np.asarray(dates)
+    if arr.dtype == object:
+        # Hash based factorization, sorting python strings is much slower
+        codes = dict()
+        inverse = np.fromiter((codes.setdefault(x, len(codes)) for x in arr.ravel()), np.int64, arr.size)
+        uniq = np.array(list(codes))
+    else:
+        uniq, inverse = np.unique(arr.ravel(), return_inverse=True)
+    return np.asarray(func(uniq))[inverse].reshape(arr.shape)
+
+
+_WEEKDAY_NAMES = np.array(list(calendar.day_name))
+_SHORT_MONTHS = np.array([x[:3].title() for x in calendar.month_name])
+_SHORT_MONTH_NUMBERS = {x.lower(): i for i, x in enumerate(_SHORT_MONTHS) if x}
+
+
+def _to_bhav_style(dates):
+    dates = parse_dates(dates)
+    months = dates.astype('datetime64[M]')
+    day = np.char.zfill(((dates - months).astype(np.int64) + 1).astype(str), 2)
+    month = _SHORT_MONTHS[months.astype(np.int64) % 12 + 1]
+    year = (months.astype('datetime64[Y]').astype(np.int64) + 1970).astype(str)
+    return np.char.add(np.char.add(np.char.add(np.char.add(day, '-'), month), '-'), year)
+
+
+def convert_dates_to_bhav_style(dates):
+    """Bulk `convert_date_to_bhav_style`: YYYYMMDD array -> DD-Mon-YYYY array
+    """
+    return _map_unique(_to_bhav_style, dates)
+
+
+def _from_bhav_style(dates):
+    result = list()
+    for date in np.char.strip(np.asarray(dates).astype(str)):
+        day, month, year = date.split('-')
+        result.append(f'{year}{_SHORT_MONTH_NUMBERS[month[:3].lower()]:02d}{int(day):02d}')
+    return np.array(result)
+
+
+def convert_bhav_dates_to_readable(dates):
+    """Bulk `convert_bhav_date_to_readable`: DD-Mon-YYYY array -> YYYYMMDD array
+    """
+    return _map_unique(_from_bhav_style, dates)
+
+
+def get_weekday_names(dates):
+    """Bulk `get_weekday_name`: weekday name of every date
+    """
+    def weekday_names(uniq):
+        # 1970-01-01 was a Thursday (weekday 3)
+        weekdays = (parse_dates(uniq).astype(np.int64) + 3) % 7
+        return _WEEKDAY_NAMES[weekdays]
+    return _map_unique(weekday_names, dates)
+
+
+def get_next_working_days(dates, holidays=Holidays_exchange, n=1):
+    """Bulk `get_next_working_day` (n-th working day after every date)
+    """
+    cal = get_trading_calendar(holidays)
+    return _map_unique(lambda uniq: cal.next(uniq, n), dates)
+
+
+def get_prev_working_days(dates, holidays=Holidays_exchange, n=1):
+    """Bulk `get_prev_working_day` (n-th working day before every date)
+    """
+    cal = get_trading_calendar(holidays)
+    return _map_unique(lambda uniq: cal.prev(uniq, n), dates)
+
+
+def get_nsefo_monthly_expiry_dates(dates, holidays=Holidays_exchange):
+    """Bulk `get_nsefo_monthly_expiry_date`
+    """
+    return _map_unique(get_expiry_schedule(holidays).monthly, dates)
+
+
+def get_nsefo_prev_monthly_expiry_dates(dates, holidays=Holidays_exchange):
+    """Bulk `get_nsefo_prev_monthly_expiry_date`
+    """
+    return _map_unique(get_expiry_schedule(holidays).prev_monthly, dates)
+
+
+def get_nsefo_weekly_expiry_dates(dates, holidays=Holidays_exchange):
+    """Bulk `get_nsefo_weekly_expiry_date`
+    """
+    return _map_unique(get_expiry_schedule(holidays).weekly, dates)
+
+
+def get_implied_weeklies_for_monthly_expiry(dates, holidays=Holidays_exchange):
+    """Bulk `get_implied_weekly_for_monthly_expiry` ('W.<n>' label of every date)
+    """
+    return _map_unique(get_expiry_schedule(holidays).implied_weekly, dates)
+
         
 if __name__ == "__main__":
     if len(sys.argv) == 1:
-        print(" Usage :: ./dates_generator -s startdate -e enddate -n num_days")
+        print(" Usage :: ./dates_generator -s startdate -e enddate -n num_days [-x NSEFO,B3] [-f holidays.yaml]")
         exit()
     parser = OptionParser()
     parser.add_option("-s", "--startdate", dest="sdate", default="-1")
     parser.add_option("-e", "--enddate", dest="edate", default="-1")
     parser.add_option("-n", "--numdays", dest="numdays", default="-1")
     parser.add_option("-w", "--weekday", dest="weekday", default="")
+    parser.add_option("-x", "--exchanges", dest="exchanges", default="NSEFO",
+                      help="Comma separated exchanges (one column of dates per exchange)")
+    parser.add_option("-f", "--holiday-file", dest="holiday_files", action="append", default=[],
+                      help="YAML/CSV holiday file to load (can be repeated)")
+    parser.add_option("-c", "--combine", dest="combine", default="",
+                      help="'union' or 'intersection' to print one combined calendar of all exchanges")
     (options, args) = parser.parse_args()
-    dates = get_working_days(options.sdate, options.edate, options.numdays, "CME", options.weekday)
-    for date in dates:
-        print(date)
+
+    for holiday_file in options.holiday_files:
+        load_calendars(holiday_file)
+    exchanges = [x.strip() for x in options.exchanges.split(',') if x.strip()]
+    try:
+        calendars = [get_calendar(exchange) for exchange in exchanges]
+        if options.combine:
+            calendars = [get_calendar(*exchanges, how=options.combine)]
+            exchanges = [options.combine]
+    except ValueError as e:
+        print(e)
+        exit(1)
+
+    for exchange, cal in zip(exchanges, calendars):
+        dates = get_working_days(options.sdate, options.edate, options.numdays, cal, options.weekday)
+        prefix = f"{exchange} " if len(exchanges) > 1 else ''
+        sys.stdout.write(''.join(f"{prefix}{date}\n" for date in dates))
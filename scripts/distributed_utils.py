@@ -0,0 +1,520 @@
+"""
+Multi-node execution backend for parallel_utils
+
+A `DistributedPool` runs on the machine driving a sweep and hands out tasks over TCP
+to worker daemons started on other hosts. It exposes the same `map`/`apply_async`
+interface as `WorkerPool`, so it can be passed as `pool=` to the `run_*`/`imap_*`
+helpers of parallel_utils.
+
+Tasks and results are dill payloads, i.e. code: anyone who can authenticate to a
+coordinator or worker can run code on it. Connections are authenticated with a
+shared secret (authkey) which has no default; set it in the environment of both
+sides (or pass it explicitly):
+    export PARALLEL_UTILS_AUTHKEY=$(python -c "import secrets; print(secrets.token_hex(32))")
+
+Start a worker daemon on every host:
+    python distributed_utils.py --worker --host <coordinator-host> --port 6000 -n 16
+
+and on the coordinator (it listens on localhost only unless told otherwise):
+    with DistributedPool(('<coordinator-host>', 6000)) as pool:
+        results = run_functions_parallel(f, params_lists, pool=pool)
+
+Workers pull tasks (one per free slot), so faster hosts automatically take more work.
+Once the queue is empty, idle workers steal long running tasks from other workers
+(the first result wins). Workers send heartbeats; tasks of workers which go silent or
+disconnect are requeued.
+"""
+
+import os
+import sys
+import time
+import socket
+import secrets
+import threading
+import traceback
+import itertools
+import subprocess as sp
+from collections import deque
+from multiprocessing.connection import Listener, Client, answer_challenge, deliver_challenge
+from optparse import OptionParser
+
+import dill
+
+from parallel_utils import WorkerPool
+
+
+AUTHKEY_ENV = 'PARALLEL_UTILS_AUTHKEY'
+
+
+def get_authkey(authkey=None):
+    """Resolve the shared secret: explicit value, else the PARALLEL_UTILS_AUTHKEY env variable
+
+    Returns:
+        bytes or None: Authkey (None if not configured)
+    """
+    if authkey is None:
+        authkey = os.environ.get(AUTHKEY_ENV) or None
+    if isinstance(authkey, str):
+        authkey = authkey.encode('utf-8')
+    return authkey
+
+
+class RemoteTaskError(Exception):
+    """Exception raised on a worker, carrying the remote traceback
+    """
+
+    def __init__(self, error, remote_traceback):
+        super(RemoteTaskError, self).__init__(error)
+        self.remote_traceback = remote_traceback
+
+    def __str__(self):
+        return "{}\n\nRemote traceback:\n{}".format(self.args[0], self.remote_traceback)
+
+
+class _DistResult(object):
+    """AsyncResult-like handle of a task submitted to a DistributedPool
+    """
+
+    def __init__(self, callback=None, error_callback=None):
+        self._event = threading.Event()
+        self._callback = callback
+        self._error_callback = error_callback
+        self._ok = None
+        self._value = None
+
+    def _set(self, ok, value):
+        self._ok, self._value = ok, value
+        self._event.set()
+        if ok and self._callback is not None:
+            self._callback(value)
+        if not ok and self._error_callback is not None:
+            self._error_callback(value)
+
+    def ready(self):
+        return self._event.is_set()
+
+    def get(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise TimeoutError("Task not finished within {} seconds".format(timeout))
+        if not self._ok:
+            raise self._value
+        return self._value
+
+
+def _apply_chunk(func, chunk):
+    return [func(item) for item in chunk]
+
+
+def _execute_payload(payload):
+    """Worker process side: run one task payload, never raise
+
+    Returns:
+        tuple: (bool if succeeded, pickled result or (error repr, traceback))
+    """
+    try:
+        func, args, kwds = dill.loads(payload)
+        return True, dill.dumps(func(*args, **kwds))
+    except Exception as err:
+        return False, (repr(err), traceback.format_exc())
+
+
+class DistributedPool(object):
+    """Coordinator handing out tasks to remote worker daemons
+
+    Args:
+        address (tuple): (host, port) to listen on. Port 0 picks a free port (see `self.address`).
+            Defaults to localhost, use the host's address to accept remote workers
+        authkey (bytes): Shared secret, must match the workers'. Defaults to the
+            PARALLEL_UTILS_AUTHKEY env variable, else a random key is generated (see `self.authkey`)
+        heartbeat_timeout (float): Seconds of silence after which a worker is declared dead
+        steal_after (float): Min seconds a task must have been running before an idle
+            worker may steal it (None disables work stealing)
+    """
+
+    def __init__(self, address=('127.0.0.1', 6000), authkey=None, heartbeat_timeout=30.0, steal_after=5.0):
+        self.authkey = get_authkey(authkey) or secrets.token_hex(32).encode('utf-8')
+        # Clients are authenticated in their own thread (see `_serve`), so a failed or
+        # stalled handshake can't stop the accept loop
+        self.listener = Listener(address)
+        self.address = self.listener.address
+        self.heartbeat_timeout = heartbeat_timeout
+        self.steal_after = steal_after
+
+        self._lock = threading.RLock()
+        self._task_ids = itertools.count()
+        self._worker_ids = itertools.count()
+        self._queue = deque()
+        self._tasks = dict()      # task id -> [payload, _DistResult]
+        self._running = dict()    # task id -> {worker id: start time}
+        self._workers = dict()    # worker id -> dict(conn, send_lock, credits, last_seen, name)
+        self._closed = False
+
+        self._threads = [threading.Thread(target=self._accept_loop, daemon=True),
+                         threading.Thread(target=self._monitor_loop, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    # Pool interface
+
+    def apply_async(self, func, args=(), kwds={}, callback=None, error_callback=None):
+        result = _DistResult(callback, error_callback)
+        payload = dill.dumps((func, tuple(args), dict(kwds)))
+        with self._lock:
+            if self._closed:
+                raise ValueError("DistributedPool is closed")
+            task_id = next(self._task_ids)
+            self._tasks[task_id] = [payload, result]
+            self._queue.append(task_id)
+            self._dispatch()
+        return result
+
+    def map(self, func, iterable, chunksize=1):
+        items = list(iterable)
+        chunksize = max(1, int(chunksize))
+        handles = [self.apply_async(_apply_chunk, (func, items[i:i + chunksize]))
+                   for i in range(0, len(items), chunksize)]
+        return [result for handle in handles for result in handle.get()]
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        done = deque()
+        cond = threading.Condition()
+
+        def on_done(value):
+            with cond:
+                done.append(value)
+                cond.notify()
+
+        num_tasks = 0
+        for item in iterable:
+            self.apply_async(func, (item,), callback=lambda res: on_done((True, res)),
+                             error_callback=lambda err: on_done((False, err)))
+            num_tasks += 1
+        for _ in range(num_tasks):
+            with cond:
+                while not done:
+                    cond.wait()
+                ok, value = done.popleft()
+            if not ok:
+                raise value
+            yield value
+
+    def num_workers(self):
+        with self._lock:
+            return len(self._workers)
+
+    def wait_for_workers(self, num_workers, timeout=None):
+        """Block until at least num_workers worker daemons are connected
+
+        Returns:
+            bool: True if enough workers connected in time
+        """
+        t1 = time.time()
+        while self.num_workers() < num_workers:
+            if timeout is not None and time.time() - t1 > timeout:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self, shutdown_workers=False):
+        """Stop the coordinator. Workers go back to waiting for a coordinator,
+        or exit if shutdown_workers is set. Unfinished tasks fail with RuntimeError
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            workers = list(self._workers.values())
+            pending = [result for _, result in self._tasks.values()]
+            self._tasks.clear()
+            self._queue.clear()
+            self._running.clear()
+        for result in pending:
+            result._set(False, RuntimeError("DistributedPool closed before the task finished"))
+        for worker in workers:
+            try:
+                self._send(worker, ('shutdown',) if shutdown_workers else ('bye',))
+                worker['conn'].close()
+            except OSError:
+                pass
+        try:
+            self.listener.close()
+        except OSError:
+            pass
+
+    terminate = close
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+        return False
+
+    # Coordinator internals
+
+    def _send(self, worker, msg):
+        with worker['send_lock']:
+            worker['conn'].send_bytes(dill.dumps(msg))
+
+    def _dispatch(self):
+        """Hand out queued tasks to workers with free slots, then let idle workers steal (holds lock)
+        """
+        for worker_id, worker in list(self._workers.items()):
+            while worker['credits'] > 0:
+                task_id = self._next_task(worker_id)
+                if task_id is None:
+                    break
+                worker['credits'] -= 1
+                self._running.setdefault(task_id, dict())[worker_id] = time.time()
+                try:
+                    self._send(worker, ('task', task_id, self._tasks[task_id][0]))
+                except OSError:
+                    self._drop_worker(worker_id)
+                    break
+
+    def _next_task(self, worker_id):
+        while self._queue:
+            task_id = self._queue.popleft()
+            if task_id in self._tasks:
+                return task_id
+
+        if self.steal_after is None:
+            return None
+
+        # Queue is empty: steal the longest running task not already on this worker
+        now = time.time()
+        candidates = [(min(starts.values()), task_id) for task_id, starts in self._running.items()
+                      if worker_id not in starts and task_id in self._tasks
+                      and now - min(starts.values()) >= self.steal_after]
+        if len(candidates) == 0:
+            return None
+        return min(candidates)[1]
+
+    def _complete(self, worker_id, task_id, ok, value):
+        with self._lock:
+            if worker_id in self._workers:
+                self._workers[worker_id]['credits'] += 1
+            self._running.pop(task_id, None)
+            task = self._tasks.pop(task_id, None)
+            self._dispatch()
+
+        if task is None:
+            # Duplicate result of a stolen task
+            return
+        if ok:
+            task[1]._set(True, dill.loads(value))
+        else:
+            task[1]._set(False, RemoteTaskError(*value))
+
+    def _drop_worker(self, worker_id):
+        """Forget a worker and requeue its unfinished tasks (holds lock)
+        """
+        worker = self._workers.pop(worker_id, None)
+        if worker is None:
+            return
+        try:
+            worker['conn'].close()
+        except OSError:
+            pass
+        for task_id, starts in list(self._running.items()):
+            if worker_id in starts:
+                del starts[worker_id]
+                if len(starts) == 0:
+                    del self._running[task_id]
+                    if task_id in self._tasks:
+                        self._queue.appendleft(task_id)
+        self._dispatch()
+
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                conn = self.listener.accept()
+            except Exception:
+                if self._closed:
+                    return
+                continue
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        try:
+            # Same handshake as Listener(authkey=...).accept()
+            deliver_challenge(conn, self.authkey)
+            answer_challenge(conn, self.authkey)
+            kind, name, num_slots = dill.loads(conn.recv_bytes())
+        except Exception:
+            # Wrong key, port scanner, garbage
+            conn.close()
+            return
+
+        with self._lock:
+            worker_id = next(self._worker_ids)
+            self._workers[worker_id] = dict(conn=conn, send_lock=threading.Lock(), credits=num_slots,
+                                            last_seen=time.time(), name=name)
+            self._dispatch()
+
+        while True:
+            try:
+                msg = dill.loads(conn.recv_bytes())
+            except (OSError, EOFError):
+                break
+            with self._lock:
+                if worker_id not in self._workers:
+                    break
+                self._workers[worker_id]['last_seen'] = time.time()
+            if msg[0] == 'result':
+                self._complete(worker_id, *msg[1:])
+
+        with self._lock:
+            self._drop_worker(worker_id)
+
+    def _monitor_loop(self):
+        while not self._closed:
+            time.sleep(min(1.0, self.heartbeat_timeout / 4.0))
+            with self._lock:
+                now = time.time()
+                for worker_id, worker in list(self._workers.items()):
+                    if now - worker['last_seen'] > self.heartbeat_timeout:
+                        self._drop_worker(worker_id)
+                # Periodic dispatch lets idle workers steal stragglers
+                self._dispatch()
+
+
+def run_worker(address, authkey=None, num_processes=4, executor='process', heartbeat_interval=5.0,
+               reconnect=True, retry_interval=2.0, verbose=False):
+    """Worker daemon: connect to a coordinator and execute its tasks on a local pool
+
+    Args:
+        address (tuple): (host, port) of the coordinator
+        authkey (bytes): Shared secret (defaults to the PARALLEL_UTILS_AUTHKEY env variable, required)
+        num_processes (int): Number of local workers (and tasks requested at a time)
+        executor (str): Executor of the local WorkerPool
+        heartbeat_interval (float): Seconds between heartbeats
+        reconnect (bool): Wait for the next coordinator after one goes away
+        retry_interval (float): Seconds between connection attempts
+        verbose (bool): Print connection info
+    """
+    authkey = get_authkey(authkey)
+    if authkey is None:
+        raise ValueError("No authkey given. Pass one or set {}".format(AUTHKEY_ENV))
+
+    pool = WorkerPool(num_processes, executor=executor)
+    try:
+        while True:
+            try:
+                conn = Client(address, authkey=authkey)
+            except OSError:
+                if not reconnect:
+                    return
+                time.sleep(retry_interval)
+                continue
+
+            if verbose:
+                print("Connected to coordinator at {}".format(address))
+            shutdown = _serve_coordinator(conn, pool, num_processes, heartbeat_interval)
+            if verbose:
+                print("Disconnected from coordinator at {}".format(address))
+            if shutdown or not reconnect:
+                return
+            time.sleep(retry_interval)
+    finally:
+        pool.close()
+
+
+def _serve_coordinator(conn, pool, num_processes, heartbeat_interval):
+    """Execute tasks from one coordinator connection until it goes away
+
+    Returns:
+        bool: True if the coordinator asked the daemon to shut down
+    """
+    send_lock = threading.Lock()
+    stop = threading.Event()
+
+    def send(msg):
+        try:
+            with send_lock:
+                conn.send_bytes(dill.dumps(msg))
+        except OSError:
+            stop.set()
+
+    def heartbeat():
+        while not stop.wait(heartbeat_interval):
+            send(('heartbeat',))
+
+    def on_done(task_id, res):
+        send(('result', task_id) + tuple(res))
+
+    send(('hello', socket.gethostname(), num_processes))
+    threading.Thread(target=heartbeat, daemon=True).start()
+
+    shutdown = False
+    while not stop.is_set():
+        try:
+            msg = dill.loads(conn.recv_bytes())
+        except (OSError, EOFError):
+            break
+        if msg[0] == 'task':
+            _, task_id, payload = msg
+            pool.apply_async(_execute_payload, (payload,), callback=lambda res, task_id=task_id: on_done(task_id, res))
+        elif msg[0] in ('bye', 'shutdown'):
+            shutdown = msg[0] == 'shutdown'
+            break
+
+    stop.set()
+    try:
+        conn.close()
+    except OSError:
+        pass
+    return shutdown
+
+
+def start_local_workers(address, num_workers=2, num_processes=2, authkey=None):
+    """Start worker daemons on localhost as subprocesses (for testing a DistributedPool)
+
+    Args:
+        address (tuple): (host, port) of the coordinator
+        num_workers (int): Number of daemons
+        num_processes (int): Processes per daemon
+        authkey (bytes): Shared secret, e.g. `pool.authkey` (defaults to the PARALLEL_UTILS_AUTHKEY env variable)
+
+    Returns:
+        list: sp.Popen objects (terminate them when done)
+    """
+    authkey = get_authkey(authkey)
+    if authkey is None:
+        raise ValueError("No authkey given. Pass one or set {}".format(AUTHKEY_ENV))
+
+    script = os.path.abspath(__file__)
+    cmd = [sys.executable, script, '--worker', '--host', str(address[0]), '--port', str(address[1]),
+           '-n', str(num_processes), '--once']
+    # Secret goes through the environment, command lines are visible to other users
+    env = dict(os.environ, **{AUTHKEY_ENV: authkey.decode('utf-8')})
+    return [sp.Popen(cmd, cwd=os.path.dirname(script), env=env) for _ in range(num_workers)]
+
+
+def ParseCommandlineArgs():
+    parser = OptionParser()
+    parser.add_option("--worker", dest="worker", action="store_true", default=False)
+    parser.add_option("--host", dest="host", default="127.0.0.1")
+    parser.add_option("--port", dest="port", default="6000")
+    parser.add_option("-n", "--numprocesses", dest="num_processes", default="4")
+    parser.add_option("-e", "--executor", dest="executor", default="process")
+    parser.add_option("--authkey", dest="authkey", default=None,
+                      help="Shared secret (default: ${} env variable)".format(AUTHKEY_ENV))
+    parser.add_option("--once", dest="once", action="store_true", default=False)
+
+    options, _ = parser.parse_args()
+
+    return options
+
+
+if __name__ == "__main__":
+    options = ParseCommandlineArgs()
+    if not options.worker:
+        print(" Usage :: python distributed_utils.py --worker --host HOST --port PORT -n NUM_PROCESSES")
+        exit()
+    authkey = get_authkey(options.authkey)
+    if authkey is None:
+        print("No authkey given. Use --authkey or set {}".format(AUTHKEY_ENV))
+        exit(1)
+    run_worker((options.host, int(options.port)), authkey, int(options.num_processes),
+               options.executor, reconnect=not options.once, verbose=True)
@@ -3,15 +3,39 @@ Utility functions required to parallelize execution
 """
 
 import multiprocess as mp
+from multiprocess.pool import ThreadPool
 # import multiprocessing as mp
 from concurrent import futures
 import os
 import time
+import asyncio
+import signal
+import threading
+import subprocess as sp
+from collections import namedtuple
+import atexit
+import queue
+import heapq
+import json
+import pickle
+import hashlib
+import struct
+import zlib
+import inspect
+import traceback
+import itertools
+from multiprocessing import shared_memory
 
+import dill
 import numpy as np
 import pandas as pd
 
-from utils import get_command_output
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+from utils import get_command_output, store_data, load_data, mkdirs, silent_remove
 
 
 def run_command(cmd):
@@ -24,7 +48,8 @@ def run_function(params):
 
     if type(all_args[-1]) == dict and '__kwargs' in all_args[-1]:
         args = all_args[:-1]
-        kwargs = all_args[-1]
+        # Copy, since with thread/serial executors the caller's dict is not pickled
+        kwargs = dict(all_args[-1])
         del kwargs['__kwargs']
 
         return func(*args, **kwargs)
@@ -33,18 +58,940 @@ def run_function(params):
         return func(*args)
 
 
-def run_command_parallel(cmds, num_processes=4, chunksize=1, verbose=False, get_output=False):
+EXECUTORS = ['process', 'thread', 'serial', 'auto']
+
+
+class SerialPool(object):
+    """Pool-like object running every task in the calling process, one after another
+
+    Useful for debugging (breakpoints, tracebacks) and for tiny workloads.
+    """
+    _state = 'RUN'
+    _pool = []
+
+    def map(self, func, iterable, chunksize=1):
+        return [func(item) for item in iterable]
+
+    def imap(self, func, iterable, chunksize=1):
+        return (func(item) for item in iterable)
+
+    imap_unordered = imap
+
+    def apply_async(self, func, args=(), kwds={}, callback=None, error_callback=None):
+        try:
+            result = func(*args, **kwds)
+        except Exception as err:
+            if error_callback is None:
+                raise
+            error_callback(err)
+            return
+        if callback is not None:
+            callback(result)
+
+    def close(self):
+        return
+
+    terminate = join = close
+
+
+def probe_executor(func, task, cpu_ratio_threshold=0.5):
+    """Pick 'thread' or 'process' executor by running one task in the calling thread
+
+    A task which holds the CPU (and so the GIL) for most of its wall time needs processes.
+    A task which mostly waits (I/O, sleeping, subprocesses) runs fine, and much lighter,
+    on threads.
+
+    Args:
+        func (function): Function to probe
+        task: Argument to call func with
+        cpu_ratio_threshold (float): CPU time / wall time below which threads are chosen
+
+    Returns:
+        tuple: (executor name, result of the task)
+    """
+    wall_start, cpu_start = time.perf_counter(), time.thread_time()
+    result = func(task)
+    wall, cpu = time.perf_counter() - wall_start, time.thread_time() - cpu_start
+
+    executor = 'thread' if cpu < cpu_ratio_threshold * wall else 'process'
+    return executor, result
+
+
+_WORKER_STATE = dict()
+_WORKER_STATE_LOCK = threading.RLock()
+
+
+def get_worker_state(key, loader=None, *args, **kwargs):
+    """Get a per-worker cached object, loading it on first use
+
+    Each worker process keeps its own cache, so heavy artifacts are loaded once per
+    worker instead of once per task. Functions run by the `run_*` helpers can call this
+    directly:
+
+        def score(word):
+            word_to_vec = get_worker_state('glove', read_glove_vecs, 'glove.6B.50d.txt')[1]
+            ...
+
+    Args:
+        key (str): Name of the object
+        loader (function): Called as loader(*args, **kwargs) if key is not cached yet
+        args: Positional args of loader
+        kwargs: Keyword args of loader
+
+    Returns:
+        Cached object (None if missing and no loader given)
+    """
+    with _WORKER_STATE_LOCK:
+        if key not in _WORKER_STATE:
+            if loader is None:
+                return None
+            _WORKER_STATE[key] = loader(*args, **kwargs)
+        return _WORKER_STATE[key]
+
+
+def set_worker_state(key, value):
+    """Store an object in the per-worker cache (e.g. from a pool initializer)
+    """
+    with _WORKER_STATE_LOCK:
+        _WORKER_STATE[key] = value
+
+
+def clear_worker_state():
+    with _WORKER_STATE_LOCK:
+        _WORKER_STATE.clear()
+
+
+def _init_worker(initializer, initargs, worker_state):
+    """Pool initializer: seed the per-worker cache, then run the user initializer
+    """
+    if worker_state:
+        for key, value in worker_state.items():
+            set_worker_state(key, value)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+BLAS_THREAD_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS',
+                    'NUMEXPR_NUM_THREADS', 'BLIS_NUM_THREADS']
+
+
+def _parse_cpulist(text):
+    cpus = list()
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def get_cpu_topology():
+    """Get CPUs available to this process grouped by NUMA node
+
+    Reads /sys/devices/system/node (Linux). Falls back to a single node with
+    all available CPUs elsewhere.
+
+    Returns:
+        list: One sorted list of cpu ids per NUMA node
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        available = set(os.sched_getaffinity(0))
+    else:
+        available = set(range(os.cpu_count() or 1))
+
+    nodes = list()
+    node_dir = '/sys/devices/system/node'
+    if os.path.isdir(node_dir):
+        for name in sorted(os.listdir(node_dir)):
+            if not (name.startswith('node') and name[4:].isdigit()):
+                continue
+            with open(os.path.join(node_dir, name, 'cpulist')) as f:
+                cpus = sorted(set(_parse_cpulist(f.read())) & available)
+            if cpus:
+                nodes.append(cpus)
+    if not nodes:
+        nodes = [sorted(available)]
+    return nodes
+
+
+def plan_workers(num_processes=None, threads_per_worker=None, n_cpus=None):
+    """Choose a process x thread split so that num_processes * threads_per_worker == n_cpus
+
+    Args:
+        num_processes (int): Number of worker processes. None to derive from threads_per_worker
+        threads_per_worker (int or 'auto'): BLAS/OpenMP threads per worker. None or 'auto' to derive
+            from num_processes
+        n_cpus (int): Number of cores to plan for (defaults to the CPUs available to this process)
+
+    Returns:
+        tuple: (num_processes, threads_per_worker)
+    """
+    if n_cpus is None:
+        n_cpus = sum(len(cpus) for cpus in get_cpu_topology())
+    if threads_per_worker == 'auto':
+        threads_per_worker = None
+    if num_processes is None and threads_per_worker is None:
+        # One single threaded worker per core scales best for independent tasks
+        return n_cpus, 1
+    if num_processes is None:
+        return max(1, n_cpus // threads_per_worker), threads_per_worker
+    if threads_per_worker is None:
+        threads_per_worker = max(1, n_cpus // num_processes)
+    return num_processes, threads_per_worker
+
+
+def get_cpu_sets(num_workers, threads_per_worker=1, topology=None):
+    """Split CPUs into one set per worker without crossing NUMA nodes
+
+    Sets are handed out round robin across nodes so that a partly used machine
+    still spreads workers (and their memory bandwidth) over all nodes. If there
+    are more workers than sets, sets are reused.
+
+    Args:
+        num_workers (int): Number of workers
+        threads_per_worker (int): CPUs per set
+        topology (list): Output of `get_cpu_topology` (computed if None)
+
+    Returns:
+        list: num_workers lists of cpu ids
+    """
+    if topology is None:
+        topology = get_cpu_topology()
+    per_node = list()
+    for cpus in topology:
+        size = min(threads_per_worker, len(cpus))
+        per_node.append([cpus[i:i + size] for i in range(0, len(cpus) - size + 1, size)])
+    sets = [cpu_set for group in itertools.zip_longest(*per_node) for cpu_set in group if cpu_set is not None]
+    return [sets[i % len(sets)] for i in range(num_workers)]
+
+
+def limit_threads(num_threads):
+    """Cap BLAS/OpenMP threads of the current process
+
+    Sets the usual environment variables (for libraries loaded later) and, if
+    threadpoolctl is installed, also resizes pools of libraries already loaded
+    (e.g. numpy's BLAS imported before the workers were forked). Without
+    threadpoolctl, already loaded libraries keep their thread count.
+    """
+    for var in BLAS_THREAD_VARS:
+        os.environ[var] = str(num_threads)
+    if threadpool_limits is not None:
+        threadpool_limits(limits=num_threads)
+
+
+def _init_placed_worker(cpu_sets, counter, threads_per_worker, initializer, initargs, worker_state):
+    """Pool initializer: pin the worker to the next cpu set and cap its threads, then `_init_worker`
+    """
+    if cpu_sets and hasattr(os, 'sched_setaffinity'):
+        with counter.get_lock():
+            idx = counter.value
+            counter.value += 1
+        try:
+            os.sched_setaffinity(0, cpu_sets[idx % len(cpu_sets)])
+        except OSError as e:
+            print('Could not pin worker {} to cpus {}: {}'.format(os.getpid(), cpu_sets[idx % len(cpu_sets)], e))
+    if threads_per_worker:
+        limit_threads(threads_per_worker)
+    _init_worker(initializer, initargs, worker_state)
+
+
+class WorkerPool(object):
+    """Long-lived, lazily created pool of workers
+
+    The underlying pool is only started on first use and is kept alive
+    across calls, so repeated `run_*` calls do not pay the fork/import cost
+    every time. Dead workers are detected before every use and the pool is
+    respawned if needed.
+
+    Executors:
+        'process': `mp.Pool` of worker processes (CPU bound work)
+        'thread': Pool of threads, no pickling and little memory (I/O bound work)
+        'serial': Run everything in the calling process
+        'auto': Probe the first task (see `probe_executor`) and pick 'thread' or 'process'.
+            The probe runs in the calling process, so pools with an initializer or
+            worker_state are not probed and use processes
+
+    Worker state:
+        initializer(*initargs) runs once in every worker when it starts (also after a
+        respawn), and worker_state entries are put in every worker's cache. Tasks read
+        them with `get_worker_state`.
+
+    Placement ('process' executor only):
+        threads_per_worker caps the BLAS/OpenMP threads of every worker ('auto' splits
+        the cores evenly between workers; with num_processes=None the number of workers
+        is derived from it too, see `plan_workers`). cpu_affinity=True pins every worker
+        to its own set of threads_per_worker cores inside one NUMA node (Linux only); a
+        list of cpu sets can also be given explicitly.
+
+    Example:
+        with WorkerPool(8, initializer=load_models, initargs=(model_dir,)) as pool:
+            res1 = run_functions_parallel(f, params1, pool=pool)
+            res2 = run_functions_parallel(g, params2, pool=pool)
+
+        # 8 workers x 4 BLAS threads on a 32 core box, each pinned to 4 cores
+        pool = WorkerPool(None, threads_per_worker=4, cpu_affinity=True)
+    """
+
+    def __init__(self, num_processes=4, maxtasksperchild=None, executor='process', initializer=None, initargs=(),
+                 worker_state=None, threads_per_worker=None, cpu_affinity=None):
+        if executor not in EXECUTORS:
+            raise ValueError("Executor '{}' not supported. Use one of {}".format(executor, EXECUTORS))
+        if num_processes is None and isinstance(cpu_affinity, (list, tuple)):
+            num_processes = len(cpu_affinity)
+        if num_processes is None or threads_per_worker == 'auto':
+            num_processes, threads_per_worker = plan_workers(num_processes, threads_per_worker)
+        if cpu_affinity is True:
+            cpu_affinity = get_cpu_sets(num_processes, threads_per_worker or 1)
+        if threads_per_worker and threadpool_limits is None and executor in ('process', 'auto'):
+            print("threadpoolctl not installed: threads_per_worker={} only caps libraries loaded after the "
+                  "workers start, not numpy's BLAS (pip install threadpoolctl)".format(threads_per_worker))
+        self.threads_per_worker = threads_per_worker
+        self.cpu_sets = cpu_affinity or None
+        self.num_processes = num_processes
+        self.maxtasksperchild = maxtasksperchild
+        self.executor = executor
+        self.initializer = initializer
+        self.initargs = tuple(initargs)
+        self.worker_state = worker_state
+        self._pool = None
+        self._workers = dict()
+        self._worker_pids = set()
+        self.num_respawns = 0
+
+    @property
+    def needs_probe(self):
+        # Probing would run the initializer (and seed worker_state) in the calling process
+        return self.executor == 'auto' and self.initializer is None and not self.worker_state
+
+    def probe(self, func, task):
+        """Resolve 'auto' executor by running one task here. Returns the task's result
+        """
+        executor, result = probe_executor(func, task)
+        if self.executor == 'auto':
+            self.executor = executor
+        return result
+
+    def _track_workers(self):
+        """Remember current worker processes (exit codes stay readable after the pool drops them)
+        """
+        for worker in getattr(self._pool, '_pool', []):
+            self._workers.setdefault(id(worker), worker)
+
+    def _create(self):
+        initargs = (self.initializer, self.initargs, self.worker_state)
+        if self.executor == 'thread':
+            return ThreadPool(self.num_processes, _init_worker, initargs)
+        if self.executor == 'serial':
+            _init_worker(*initargs)
+            return SerialPool()
+        # Unprobed 'auto' pools fall back to processes
+        if self.cpu_sets or self.threads_per_worker:
+            initargs = (self.cpu_sets, mp.Value('i', 0), self.threads_per_worker) + initargs
+            return mp.Pool(self.num_processes, _init_placed_worker, initargs, maxtasksperchild=self.maxtasksperchild)
+        return mp.Pool(self.num_processes, _init_worker, initargs, maxtasksperchild=self.maxtasksperchild)
+
+    def is_healthy(self):
+        """Check if pool is started, running and none of its workers died
+
+        mp.Pool silently replaces dead workers, but a worker killed while waiting
+        for work leaves the task queue lock held and the pool hangs. So a worker
+        which exited with an error, or (without maxtasksperchild, where workers
+        never exit on their own) any change of worker pids, marks the pool unhealthy.
+        """
+        if self._pool is None:
+            return False
+        if getattr(self._pool, '_state', 'RUN') not in ('RUN', 0):
+            return False
+        workers = getattr(self._pool, '_pool', [])
+        if not all(w.is_alive() for w in workers):
+            return False
+        if self.maxtasksperchild is None and {getattr(w, "pid", None) for w in workers} != self._worker_pids:
+            return False
+        self._track_workers()
+        for key, worker in list(self._workers.items()):
+            if worker.exitcode:
+                return False
+            if worker.exitcode == 0:
+                del self._workers[key]
+        return True
+
+    def _kill_workers(self):
+        """Kill all workers of a broken pool and free the task queue lock a dead worker may hold
+
+        Otherwise `terminate` blocks forever on that lock.
+        """
+        workers = [w for w in getattr(self._pool, '_pool', []) if hasattr(w, 'kill')]
+        for worker in workers:
+            worker.kill()
+        for worker in workers:
+            worker.join()
+        lock = getattr(getattr(self._pool, '_inqueue', None), '_rlock', None)
+        if lock is not None:
+            # Either we take the free lock or it is held by a dead worker, release it in both cases
+            lock.acquire(False)
+            lock.release()
+
+    def ensure_healthy(self):
+        """Start the pool if needed, respawn it if any worker has died
+
+        Returns:
+            mp.Pool: Running pool
+        """
+        if self._pool is not None and not self.is_healthy():
+            self._kill_workers()
+            self.terminate()
+            self.num_respawns += 1
+        if self._pool is None:
+            self._pool = self._create()
+            self._workers = dict()
+            self._track_workers()
+            self._worker_pids = {getattr(w, "pid", None) for w in getattr(self._pool, "_pool", [])}
+        return self._pool
+
+    @property
+    def pool(self):
+        return self.ensure_healthy()
+
+    def map(self, func, iterable, chunksize=1):
+        return self.pool.map(func, iterable, chunksize)
+
+    def imap(self, func, iterable, chunksize=1):
+        return self.pool.imap(func, iterable, chunksize)
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        return self.pool.imap_unordered(func, iterable, chunksize)
+
+    def apply_async(self, func, args=(), kwds={}, callback=None, error_callback=None):
+        return self.pool.apply_async(func, args, kwds, callback, error_callback)
+
+    def close(self):
+        """Stop accepting work and wait for workers to finish
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def terminate(self):
+        """Stop workers immediately
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        self.ensure_healthy()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+        return False
+
+
+_DEFAULT_POOLS = dict()
+
+
+class _AutoDefaultPool(WorkerPool):
+    """Per call handle on the default pools for executor='auto'
+
+    Probes the first task of its call, then runs on the default pool of the chosen
+    executor, so every call gets its own probe while the workers are still shared.
+    """
+
+    def _default_pool(self):
+        executor = 'process' if self.executor == 'auto' else self.executor
+        return get_default_pool(self.num_processes, executor, self.initializer, self.initargs)
+
+    def is_healthy(self):
+        return self._default_pool().is_healthy()
+
+    def ensure_healthy(self):
+        return self._default_pool().ensure_healthy()
+
+    def close(self):
+        """Nothing to do, workers belong to the default pool
+        """
+
+    terminate = close
+
+
+def get_default_pool(num_processes=4, executor='process', initializer=None, initargs=()):
+    """Get module level pool shared by all `run_*` helpers (created lazily, one per executor)
+
+    executor='auto' returns a fresh handle which probes its first task and then uses the
+    default 'thread' or 'process' pool.
+
+    Args:
+        num_processes (int): Number of workers. Pool is recreated if it differs from current one
+        executor (str): One of EXECUTORS
+        initializer (function): Worker initializer. Pool is recreated if it differs from current one
+        initargs (tuple): Args of initializer
+
+    Returns:
+        WorkerPool: Shared pool
+    """
+    if executor == 'auto':
+        return _AutoDefaultPool(num_processes, executor=executor, initializer=initializer, initargs=initargs)
+    pool = _DEFAULT_POOLS.get(executor)
+    if pool is not None and (pool.num_processes != num_processes or pool.initializer is not initializer
+                             or pool.initargs != tuple(initargs)):
+        pool.close()
+        pool = None
+    if pool is None:
+        pool = WorkerPool(num_processes, executor=executor, initializer=initializer, initargs=initargs)
+        _DEFAULT_POOLS[executor] = pool
+    return pool
+
+
+def close_default_pool():
+    """Shut down module level pools (if started)
+    """
+    for executor in list(_DEFAULT_POOLS):
+        _DEFAULT_POOLS.pop(executor).close()
+
+
+atexit.register(close_default_pool)
+
+
+def _get_pool(pool, num_processes, executor='process', initializer=None, initargs=()):
+    """Resolve `pool` argument of `run_*` helpers
+
+    Args:
+        pool (None or bool or WorkerPool): None for a fresh pool per call, True for module default pool
+        num_processes (int): Number of workers
+        executor (str): Executor of fresh/default pools (ignored if a WorkerPool is given)
+        initializer (function): Worker initializer of fresh/default pools (ignored if a WorkerPool is given)
+        initargs (tuple): Args of initializer
+
+    Returns:
+        tuple: (WorkerPool, bool if pool is owned by the caller and has to be closed)
+    """
+    if pool is None or pool is False:
+        return WorkerPool(num_processes, executor=executor, initializer=initializer, initargs=initargs), True
+    if pool is True:
+        return get_default_pool(num_processes, executor, initializer, initargs), False
+    return pool, False
+
+
+class TaskStats(object):
+    """Per task instrumentation of a parallel run
+
+    Each record is a dict with keys: index, pid, submit, start, end (unix timestamps),
+    queue_wait, run_time, args_bytes, args_ser_time, args_deser_time, result_bytes,
+    result_ser_time, result_deser_time (seconds / bytes).
+    """
+
+    def __init__(self):
+        self.records = list()
+        self.start_time = None
+        self.end_time = None
+
+    def add(self, record):
+        self.records.append(record)
+
+    @property
+    def wall_time(self):
+        if self.start_time is None or self.end_time is None:
+            return 0.0
+        return self.end_time - self.start_time
+
+    def summary(self):
+        """Aggregate records to tell if a batch is CPU, pickling or straggler bound
+
+        Returns:
+            dict: Summary statistics
+        """
+        if len(self.records) == 0:
+            return dict(num_tasks=0, wall_time=self.wall_time)
+
+        def total(key):
+            return sum(rec.get(key, 0.0) for rec in self.records)
+
+        run_times = [rec['run_time'] for rec in self.records]
+        queue_waits = [rec['queue_wait'] for rec in self.records]
+        tasks_per_worker = dict()
+        for rec in self.records:
+            tasks_per_worker[rec['pid']] = tasks_per_worker.get(rec['pid'], 0) + 1
+
+        num_workers = len(tasks_per_worker)
+        wall_time = self.wall_time
+        return dict(num_tasks=len(self.records),
+                    num_workers=num_workers,
+                    wall_time=wall_time,
+                    total_run_time=total('run_time'),
+                    mean_run_time=float(np.mean(run_times)),
+                    max_run_time=float(np.max(run_times)),
+                    mean_queue_wait=float(np.mean(queue_waits)),
+                    max_queue_wait=float(np.max(queue_waits)),
+                    total_args_bytes=int(total('args_bytes')),
+                    total_result_bytes=int(total('result_bytes')),
+                    total_ser_time=total('args_ser_time') + total('args_deser_time') + total('result_ser_time') + total('result_deser_time'),
+                    utilization=total('run_time') / (wall_time * num_workers) if wall_time > 0 else 0.0,
+                    tasks_per_worker=tasks_per_worker)
+
+    def to_chrome_trace(self):
+        """Records as Chrome trace events (complete events, one lane per worker pid)
+
+        Returns:
+            list: List of trace event dicts
+        """
+        events = list()
+        for rec in self.records:
+            args = {key: val for key, val in rec.items() if key not in ('start', 'end', 'pid')}
+            events.append(dict(name='task {}'.format(rec['index']), ph='X', ts=rec['start'] * 1e6,
+                               dur=(rec['end'] - rec['start']) * 1e6, pid=rec['pid'], tid=rec['pid'], args=args))
+        return events
+
+    def write_trace(self, file_name):
+        """Write trace events to file
+
+        '.json' files get Chrome's {"traceEvents": [...]} format (load in chrome://tracing
+        or Perfetto), anything else gets one trace event per line (JSONL)
+
+        Args:
+            file_name (str): Path to output file
+        """
+        events = self.to_chrome_trace()
+        with open(file_name, 'w') as f:
+            if file_name.endswith('.json'):
+                json.dump(dict(traceEvents=events), f)
+            else:
+                for event in events:
+                    f.write(json.dumps(event) + '\n')
+        return
+
+    def __repr__(self):
+        summary = self.summary()
+        return "TaskStats(num_tasks={}, wall_time={:.3f}s, utilization={:.2f})".format(
+            summary['num_tasks'], summary['wall_time'], summary.get('utilization', 0.0))
+
+
+def _run_traced(params):
+    """Worker side wrapper recording timing and payload sizes of one task
+    """
+    func, payload, index, submit_time = params
+    start = time.time()
+    task = dill.loads(payload)
+    t1 = time.time()
+    result = func(task)
+    t2 = time.time()
+    result_payload = dill.dumps(result)
+    end = time.time()
+
+    record = dict(index=index, pid=os.getpid(), submit=submit_time, start=start, end=end,
+                  queue_wait=start - submit_time, run_time=t2 - t1, args_bytes=len(payload),
+                  args_deser_time=t1 - start, result_bytes=len(result_payload), result_ser_time=end - t2)
+    return result_payload, record
+
+
+def _trace_tasks(func, tasks, indices=None):
+    """Pickle tasks up front (timing it) and wrap them for `_run_traced`
+
+    Returns:
+        tuple: (traced tasks, list of args serialization times)
+    """
+    if indices is None:
+        indices = range(len(tasks))
+    traced, ser_times = list(), list()
+    for index, task in zip(indices, tasks):
+        t1 = time.time()
+        payload = dill.dumps(task)
+        ser_times.append(time.time() - t1)
+        traced.append((func, payload, index, time.time()))
+    return traced, ser_times
+
+
+def _untrace_result(traced_result, stats, args_ser_time):
+    """Unpickle a result of `_run_traced` and add its record to stats
+    """
+    result_payload, record = traced_result
+    t1 = time.time()
+    result = dill.loads(result_payload)
+    record['result_deser_time'] = time.time() - t1
+    record['args_ser_time'] = args_ser_time
+    stats.add(record)
+    return result
+
+
+def _get_stats(stats, trace_file):
+    """Resolve `stats`/`trace_file` arguments of `run_*` helpers
+
+    Returns:
+        TaskStats or None
+    """
+    if isinstance(stats, TaskStats):
+        return stats
+    if stats or trace_file is not None:
+        return TaskStats()
+    return None
+
+
+def _finish_stats(task_stats, trace_file):
+    if task_stats is None:
+        return
+    task_stats.end_time = time.time()
+    if trace_file is not None:
+        task_stats.write_trace(trace_file)
+
+
+def _run_timed_chunk(params):
+    """Worker side of `_auto_chunksize`: run a chunk, timing it inside the worker
+    """
+    func, chunk = params
+    t1 = time.perf_counter()
+    results = [func(task) for task in chunk]
+    return results, time.perf_counter() - t1
+
+
+def _auto_chunksize(pool, func, tasks, num_processes, target_chunk_time=0.2, sample_per_worker=8):
+    """Pick chunksize from per-task run time measured on a warm-up sample
+
+    The sample is timed inside the workers (after the pool is started), so neither
+    pool startup nor IPC latency counts as task cost. Its results are kept.
+
+    Args:
+        pool (WorkerPool): Pool to run on
+        func (function): Function to call on each task
+        tasks (list): All tasks
+        num_processes (int): Number of workers
+        target_chunk_time (float): Desired run time (in seconds) of one chunk
+        sample_per_worker (int): Sample tasks per worker
+
+    Returns:
+        tuple: (results of first `len(results)` tasks, chunksize for the rest)
+    """
+    if hasattr(pool, 'ensure_healthy'):
+        pool.ensure_healthy()
+    sample_size = min(len(tasks), sample_per_worker * num_processes)
+    step = max(1, -(-sample_size // num_processes))
+    timed = pool.map(_run_timed_chunk, [(func, tasks[i:i + step]) for i in range(0, sample_size, step)], 1)
+    results = [res for chunk_results, _ in timed for res in chunk_results]
+
+    remaining = len(tasks) - sample_size
+    if remaining <= 0:
+        return results, 1
+
+    per_task = max(sum(elapsed for _, elapsed in timed) / max(sample_size, 1), 1e-7)
+    chunksize = int(target_chunk_time / per_task)
+    # Keep at least ~4 chunks per worker so the tail can still be balanced
+    max_chunksize = max(1, remaining // (4 * num_processes))
+
+    return results, max(1, min(chunksize, max_chunksize))
+
+
+def _map_tasks(pool, func, tasks, chunksize=1, num_processes=4, costs=None, stats=None):
+    """Map func over tasks on pool with optional auto chunksize and cost-aware ordering
+
+    Args:
+        pool (WorkerPool): Pool to run on
+        func (function): Function to call on each task
+        tasks (list): Tasks
+        chunksize (int or str): Chunksize, or 'auto' to measure it on a warm-up sample
+        num_processes (int): Number of workers
+        costs (list): Optional per-task cost hints. Tasks are scheduled longest first
+        stats (TaskStats): Collect per task instrumentation into this object
+
+    Returns:
+        list: Results in the same order as tasks
+    """
+    tasks = list(tasks)
+    order = None
+    if costs is not None:
+        if len(costs) != len(tasks):
+            print("Faulty input. Size mismatch between tasks and costs")
+            return
+        order = sorted(range(len(tasks)), key=lambda i: costs[i], reverse=True)
+        tasks = [tasks[i] for i in order]
+
+    if stats is not None:
+        if stats.start_time is None:
+            stats.start_time = time.time()
+        tasks, ser_times = _trace_tasks(func, tasks, order)
+        func = _run_traced
+
+    results = list()
+    if getattr(pool, 'needs_probe', False) and len(tasks):
+        results.append(pool.probe(func, tasks[0]))
+
+    if chunksize == 'auto':
+        sample_results, chunksize = _auto_chunksize(pool, func, tasks[len(results):], num_processes)
+        results += sample_results
+    results += pool.map(func, tasks[len(results):], chunksize)
+
+    if stats is not None:
+        results = [_untrace_result(res, stats, ser_time) for res, ser_time in zip(results, ser_times)]
+
+    if order is not None:
+        ordered_results = [None] * len(results)
+        for pos, idx in enumerate(order):
+            ordered_results[idx] = results[pos]
+        results = ordered_results
+
+    return results
+
+
+class ResultCache(object):
+    """Disk backed memoization of function results
+
+    Entries are keyed on the function's qualified name, a hash of its source code and a
+    hash of the arguments, so editing the function invalidates its entries. Each entry is
+    a pickle file written with `store_data`. When `max_bytes` is set, least recently used
+    entries are evicted.
+
+    Args:
+        cache_dir (str): Directory to store entries in
+        max_bytes (int): Max total size of the cache (None for unbounded)
+    """
+
+    def __init__(self, cache_dir, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        mkdirs(cache_dir)
+
+    @staticmethod
+    def function_key(function):
+        """Qualified name and source hash of a function
+        """
+        name = '{}.{}'.format(getattr(function, '__module__', ''), getattr(function, '__qualname__', repr(function)))
+        try:
+            source = inspect.getsource(function).encode('utf-8')
+        except (OSError, TypeError):
+            code = getattr(function, '__code__', None)
+            source = code.co_code if code is not None else b''
+        return name + ':' + hashlib.sha1(source).hexdigest()
+
+    def key(self, function_key, params):
+        return hashlib.sha1(function_key.encode('utf-8') + dill.dumps(params)).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def get(self, key):
+        """Get cached result
+
+        Returns:
+            tuple: (bool if found, result)
+        """
+        path = self._path(key)
+        try:
+            result = load_data(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return False, None
+        # Touch entry so that eviction sees it as recently used
+        os.utime(path, None)
+        self.hits += 1
+        return True, result
+
+    def put(self, key, result):
+        path = self._path(key)
+        tmp_path = path + '.tmp{}'.format(os.getpid())
+        store_data(result, tmp_path)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        """Remove least recently used entries until cache fits in max_bytes
+        """
+        if self.max_bytes is None:
+            return
+        entries = list()
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pkl'):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            silent_remove(path)
+            total -= size
+        return
+
+    def clear(self):
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pkl'):
+                silent_remove(entry.path)
+
+
+def _cached_map(cache, function, params_lists, run_misses, costs=None):
+    """Serve results from cache and only run the misses
+
+    Args:
+        cache (ResultCache): Cache
+        function (function): Function being run (used for the cache key)
+        params_lists (list): Params of each call
+        run_misses (function): Called as run_misses(missed params_lists, missed costs), returns results
+        costs (list): Optional per-task cost hints
+
+    Returns:
+        list: Results in the order of params_lists
+    """
+    function_key = cache.function_key(function)
+    keys = [cache.key(function_key, params_list) for params_list in params_lists]
+
+    results = [None] * len(params_lists)
+    miss_indices = list()
+    for idx, key in enumerate(keys):
+        found, result = cache.get(key)
+        if found:
+            results[idx] = result
+        else:
+            miss_indices.append(idx)
+
+    if len(miss_indices):
+        miss_costs = None if costs is None else [costs[idx] for idx in miss_indices]
+        miss_results = run_misses([params_lists[idx] for idx in miss_indices], miss_costs)
+        for idx, result in zip(miss_indices, miss_results):
+            results[idx] = result
+            cache.put(keys[idx], result)
+        cache.evict()
+
+    return results
+
+
+def run_command_parallel(cmds, num_processes=4, chunksize=1, verbose=False, get_output=False, pool=None, costs=None,
+                         stats=False, trace_file=None, executor='process'):
+    """Run shell commands in parallel
+
+    Args:
+        cmds (list): Shell commands
+        num_processes (int): Number of processes
+        chunksize (int or str): Commands sent to a worker at once, or 'auto'
+        verbose (bool): Print timing info
+        get_output (bool): Return stdout of each command
+        pool (None or bool or WorkerPool): None for a fresh pool, True for the default pool
+        executor (str): 'process', 'thread' (I/O bound work), 'serial' or 'auto' (probe first task)
+        costs (list): Optional per-command cost hints for longest-first scheduling
+        stats (bool or TaskStats): Collect per task instrumentation. If set, returns (results, TaskStats)
+        trace_file (str): Write per task trace events to this file (see `TaskStats.write_trace`)
+    """
     if verbose:
         print("Running {} commands, {} at a time..".format(len(cmds), num_processes))
 
     t1 = time.time()
-    pool = mp.Pool(num_processes)
-    if get_output:
-        results = pool.map(get_command_output, cmds, chunksize)
-    else:
-        results = pool.map(run_command, cmds, chunksize)
-    pool.close()
-    pool.join()
+    task_stats = _get_stats(stats, trace_file)
+    pool, owned = _get_pool(pool, num_processes, executor)
+    try:
+        if get_output:
+            results = _map_tasks(pool, get_command_output, cmds, chunksize, num_processes, costs, task_stats)
+        else:
+            results = _map_tasks(pool, run_command, cmds, chunksize, num_processes, costs, task_stats)
+    except BaseException:
+        if owned:
+            pool.terminate()
+        raise
+    if owned:
+        pool.close()
+    _finish_stats(task_stats, trace_file)
     t2 = time.time()
 
     total_time = t2 - t1
@@ -52,69 +999,885 @@ def run_command_parallel(cmds, num_processes=4, chunksize=1, verbose=False, get_
     if verbose:
         print("Time to run {} commands: {} seconds or {} minutes or {} hours".format(len(cmds), total_time, (total_time) / 60.0, (total_time) / 3600.0))
 
+    if stats:
+        return (results if get_output else None), task_stats
+
     if get_output:
         return results
     else:
         return
 
 
-def run_functions_parallel(function, params_lists, num_processes=4, chunksize=1, verbose=False):
+def run_functions_parallel(function, params_lists, num_processes=4, chunksize=1, verbose=False, pool=None,
+                           costs=None, stats=False, trace_file=None, cache_dir=None, cache_max_bytes=None,
+                           executor='process', window=None, initializer=None, initargs=()):
+    """Run function for each params list in parallel
+
+    Args:
+        function (function): Function to run
+        params_lists (list or iterable): List of args lists. Last item can be a kwargs dict with a '__kwargs' key.
+            A generator is consumed lazily (see `imap_functions_parallel`) unless costs, cache_dir
+            or chunksize='auto' need the full list
+        num_processes (int): Number of processes
+        chunksize (int or str): Tasks sent to a worker at once, or 'auto' to measure it on a warm-up sample
+        verbose (bool): Print timing info
+        pool (None or bool or WorkerPool): None for a fresh pool, True for the default pool
+        executor (str): 'process', 'thread' (I/O bound work), 'serial' or 'auto' (probe first task)
+        costs (list): Optional per-task cost hints. Heaviest tasks are started first
+        stats (bool or TaskStats): Collect per task instrumentation. If set, returns (results, TaskStats)
+        trace_file (str): Write per task trace events to this file (see `TaskStats.write_trace`)
+        cache_dir (str or ResultCache): Memoize results on disk. Only cache misses are sent to the pool
+        cache_max_bytes (int): Evict least recently used cache entries beyond this size
+        window (int): Max tasks (or chunks) in flight when params_lists is a generator (default 4 * num_processes)
+        initializer (function): Run once in every worker on start (see `get_worker_state`)
+        initargs (tuple): Args of initializer
+
+    Returns:
+        list: Results in the order of params_lists
+    """
+    streaming = not hasattr(params_lists, '__len__')
+    if streaming and (costs is not None or cache_dir is not None or chunksize == 'auto'):
+        params_lists = list(params_lists)
+        streaming = False
+
     if verbose:
-        print("Running {} functions parallelly, {} at a time..".format(len(params_lists), num_processes))
+        num_tasks = 'all' if streaming else len(params_lists)
+        print("Running {} functions parallelly, {} at a time..".format(num_tasks, num_processes))
 
     t1 = time.time()
-    iterable = [(function, params_list) for params_list in params_lists]
-    pool = mp.Pool(num_processes)
-    results = pool.map(run_function, iterable, chunksize)
-    pool.close()
-    pool.join()
+    task_stats = _get_stats(stats, trace_file)
+    pool, owned = _get_pool(pool, num_processes, executor, initializer, initargs)
+
+    def run_params(params_lists, costs):
+        iterable = [(function, params_list) for params_list in params_lists]
+        return _map_tasks(pool, run_function, iterable, chunksize, num_processes, costs, task_stats)
+
+    try:
+        if streaming:
+            iterable = ((function, params_list) for params_list in params_lists)
+            if task_stats is not None:
+                task_stats.start_time = time.time()
+            results = [result for _, result in _imap_chunked(pool, run_function, iterable, True, window or 4 * num_processes,
+                                                             task_stats, chunksize)]
+        elif cache_dir is None:
+            results = run_params(params_lists, costs)
+        else:
+            cache = cache_dir if isinstance(cache_dir, ResultCache) else ResultCache(cache_dir, cache_max_bytes)
+            results = _cached_map(cache, function, params_lists, run_params, costs)
+            if verbose:
+                print("Cache hits: {}, misses: {}".format(cache.hits, cache.misses))
+    except BaseException:
+        if owned:
+            pool.terminate()
+        raise
+    if owned:
+        pool.close()
+    _finish_stats(task_stats, trace_file)
     t2 = time.time()
 
     total_time = t2 - t1
 
     if verbose:
-        print("Time to run {}() function, {} times in parallel: {} seconds or {} minutes or {} hours".format(function.__name__, len(params_lists), total_time, (total_time) / 60.0, (total_time) / 3600.0))
+        print("Time to run {}() function, {} times in parallel: {} seconds or {} minutes or {} hours".format(function.__name__, len(results), total_time, (total_time) / 60.0, (total_time) / 3600.0))
+
+    if stats:
+        return results, task_stats
 
     return results
 
 
-def run_mult_functions_parallel(function_tuple_lists, num_processes=4, chunksize=1, verbose=False):
+def run_mult_functions_parallel(function_tuple_lists, num_processes=4, chunksize=1, verbose=False, pool=None,
+                                costs=None, stats=False, trace_file=None, executor='process', window=None,
+                                initializer=None, initargs=()):
+    """Run different functions in parallel
+
+    Args:
+        function_tuple_lists (list or iterable): List of (function, args list) tuples. A generator is
+            consumed lazily unless costs or chunksize='auto' need the full list
+        num_processes (int): Number of processes
+        chunksize (int or str): Tasks sent to a worker at once, or 'auto'
+        verbose (bool): Print timing info
+        pool (None or bool or WorkerPool): None for a fresh pool, True for the default pool
+        executor (str): 'process', 'thread' (I/O bound work), 'serial' or 'auto' (probe first task)
+        costs (list): Optional per-task cost hints. Heaviest tasks are started first so
+            long tail tasks do not serialize the end of the batch
+        stats (bool or TaskStats): Collect per task instrumentation. If set, returns (results, TaskStats)
+        trace_file (str): Write per task trace events to this file (see `TaskStats.write_trace`)
+        window (int): Max tasks (or chunks) in flight when function_tuple_lists is a generator
+        initializer (function): Run once in every worker on start (see `get_worker_state`)
+        initargs (tuple): Args of initializer
+
+    Returns:
+        list: Results in the order of function_tuple_lists
+    """
+    streaming = not hasattr(function_tuple_lists, '__len__')
+    if streaming and (costs is not None or chunksize == 'auto'):
+        function_tuple_lists = list(function_tuple_lists)
+        streaming = False
+
     if verbose:
-        print("Running {} functions parallelly, {} at a time..".format(len(function_tuple_lists), num_processes))
+        num_tasks = 'all' if streaming else len(function_tuple_lists)
+        print("Running {} functions parallelly, {} at a time..".format(num_tasks, num_processes))
     t1 = time.time()
-    pool = mp.Pool(num_processes)
-    results = pool.map(run_function, function_tuple_lists, chunksize)
-    pool.close()
-    pool.join()
+    task_stats = _get_stats(stats, trace_file)
+    pool, owned = _get_pool(pool, num_processes, executor, initializer, initargs)
+    try:
+        if streaming:
+            if task_stats is not None:
+                task_stats.start_time = time.time()
+            results = [result for _, result in _imap_chunked(pool, run_function, function_tuple_lists, True,
+                                                             window or 4 * num_processes, task_stats, chunksize)]
+        else:
+            results = _map_tasks(pool, run_function, function_tuple_lists, chunksize, num_processes, costs, task_stats)
+    except BaseException:
+        if owned:
+            pool.terminate()
+        raise
+    if owned:
+        pool.close()
+    _finish_stats(task_stats, trace_file)
     t2 = time.time()
     total_time = t2 - t1
     if verbose:
-        print("Time to run mult functions, {} times in parallel: {} seconds or {} minutes or {} hours".format(len(function_tuple_lists), total_time, (total_time) / 60.0, (total_time) / 3600.0))
+        print("Time to run mult functions, {} times in parallel: {} seconds or {} minutes or {} hours".format(len(results), total_time, (total_time) / 60.0, (total_time) / 3600.0))
+    if stats:
+        return results, task_stats
     return results
 
 
-def parallelize_dataframe(df, func, n_cores=4):
+class WorkerLostError(RuntimeError):
+    """A pool worker died (e.g. os._exit, OOM kill) while tasks were in flight, their results are lost
+    """
+
+
+def _wait_result(done, pool, poll_interval=1.0):
+    """Get the next (index, ok, value) from done, checking pool health while waiting
+
+    mp.Pool replaces a worker which died mid-task but the task's result never arrives.
+    """
+    is_healthy = getattr(pool, 'is_healthy', None)
+    if is_healthy is None:
+        return done.get()
+    while True:
+        try:
+            return done.get(timeout=poll_interval)
+        except queue.Empty:
+            if not is_healthy():
+                raise WorkerLostError("A pool worker died while tasks were in flight")
+
+
+def _imap_tasks(pool, func, tasks, ordered=True, window=8, stats=None):
+    """Lazily submit tasks to pool and yield (index, result) as they finish
+
+    At most `window` tasks are in flight or waiting in the reorder buffer at any
+    time, so memory stays bounded and `tasks` is only consumed as workers free up.
+
+    Args:
+        pool (WorkerPool): Pool to submit tasks to
+        func (function): Function to call on each task
+        tasks (iterable): Tasks (consumed lazily)
+        ordered (bool): Yield in submission order (True) or in completion order (False)
+        window (int): Max number of tasks in flight
+        stats (TaskStats): Collect per task instrumentation into this object
+
+    Yields:
+        tuple: (index, result)
+
+    Raises:
+        WorkerLostError: If a worker of a WorkerPool died while tasks were in flight
+    """
+    done = queue.Queue()
+    tasks = iter(tasks)
+    exhausted = False
+    in_flight = 0
+    next_index = 0
+    next_to_yield = 0
+    buffered = dict()
+    ser_times = dict()
+    if stats is not None and stats.start_time is None:
+        stats.start_time = time.time()
+
+    while True:
+        while not exhausted and in_flight + len(buffered) < window:
+            try:
+                task = next(tasks)
+            except StopIteration:
+                exhausted = True
+                break
+            task_func = func
+            if stats is not None:
+                (task,), (ser_times[next_index],) = _trace_tasks(func, [task], [next_index])
+                task_func = _run_traced
+            if getattr(pool, 'needs_probe', False):
+                try:
+                    done.put((next_index, True, pool.probe(task_func, task)))
+                except Exception as err:
+                    done.put((next_index, False, err))
+            else:
+                pool.apply_async(task_func, (task,),
+                                 callback=lambda res, idx=next_index: done.put((idx, True, res)),
+                                 error_callback=lambda err, idx=next_index: done.put((idx, False, err)))
+            next_index += 1
+            in_flight += 1
+
+        if in_flight == 0:
+            break
+
+        idx, ok, value = _wait_result(done, pool)
+        in_flight -= 1
+        if not ok:
+            raise value
+        if stats is not None:
+            value = _untrace_result(value, stats, ser_times.pop(idx))
+            stats.end_time = time.time()
+
+        if not ordered:
+            yield idx, value
+            continue
+
+        buffered[idx] = value
+        while next_to_yield in buffered:
+            yield next_to_yield, buffered.pop(next_to_yield)
+            next_to_yield += 1
+
+
+def _iter_chunks(iterable, chunksize):
+    """Lazily group an iterable into lists of chunksize items
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunksize))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+
+def _run_chunk(params):
+    func, chunk = params
+    return [func(task) for task in chunk]
+
+
+def _imap_chunked(pool, func, tasks, ordered=True, window=8, stats=None, chunksize=1):
+    """`_imap_tasks` sending tasks to workers in lazily built chunks
+
+    With chunksize > 1, window counts chunks and stats records are per chunk.
+
+    Yields:
+        tuple: (index, result) per task
+    """
+    if chunksize == 1:
+        for idx, result in _imap_tasks(pool, func, tasks, ordered, window, stats):
+            yield idx, result
+        return
+
+    chunk_tasks = ((func, chunk) for chunk in _iter_chunks(tasks, chunksize))
+    for chunk_idx, chunk_results in _imap_tasks(pool, _run_chunk, chunk_tasks, ordered, window, stats):
+        for pos, result in enumerate(chunk_results):
+            yield chunk_idx * chunksize + pos, result
+
+
+def imap_functions_parallel(function, params_lists, num_processes=4, ordered=True, window=None, pool=None,
+                            stats=None, executor='process', chunksize=1, initializer=None, initargs=()):
+    """Streaming version of `run_functions_parallel`
+
+    Yields results as soon as they are ready instead of returning everything at the end,
+    so results can be written out incrementally. params_lists can be any (even infinite)
+    iterable or generator: it is only advanced when a worker frees up, so memory stays
+    constant and producers (e.g. file scanners) are throttled to the consumption rate.
+
+    Args:
+        function (function): Function to run
+        params_lists (iterable): Parameters for each call (same format as `run_functions_parallel`)
+        num_processes (int): Number of processes
+        ordered (bool): Yield results in input order or as they complete
+        window (int): Max tasks in flight (default 4 * num_processes). Bounds peak memory
+        pool (None or bool or WorkerPool): See `_get_pool`
+        executor (str): 'process', 'thread' (I/O bound work), 'serial' or 'auto' (probe first task)
+        stats (TaskStats): Collect per task instrumentation into this object while iterating
+        chunksize (int): Tasks sent to a worker at once (window then counts chunks)
+        initializer (function): Run once in every worker on start (see `get_worker_state`)
+        initargs (tuple): Args of initializer
+
+    Yields:
+        tuple: (index, result)
+
+    Example:
+        for idx, res in imap_functions_parallel(f, params, ordered=False):
+            store_data(res, f'out/{idx}.pkl')
+    """
+    if window is None:
+        window = 4 * num_processes
+
+    iterable = ((function, params_list) for params_list in params_lists)
+    pool, owned = _get_pool(pool, num_processes, executor, initializer, initargs)
+    try:
+        for idx, result in _imap_chunked(pool, run_function, iterable, ordered, window, stats, chunksize):
+            yield idx, result
+    except BaseException:
+        if owned:
+            pool.terminate()
+        raise
+    if owned:
+        pool.close()
+
+
+def imap_mult_functions_parallel(function_tuple_lists, num_processes=4, ordered=True, window=None, pool=None,
+                                 stats=None, executor='process', chunksize=1, initializer=None, initargs=()):
+    """Streaming version of `run_mult_functions_parallel`. See `imap_functions_parallel`
+
+    Args:
+        function_tuple_lists (iterable): (function, params_list) tuples (same format as `run_mult_functions_parallel`)
+        num_processes (int): Number of processes
+        ordered (bool): Yield results in input order or as they complete
+        window (int): Max tasks in flight (default 4 * num_processes). Bounds peak memory
+        pool (None or bool or WorkerPool): See `_get_pool`
+        stats (TaskStats): Collect per task instrumentation into this object while iterating
+        executor (str): 'process', 'thread' (I/O bound work), 'serial' or 'auto' (probe first task)
+        chunksize (int): Tasks sent to a worker at once (window then counts chunks)
+        initializer (function): Run once in every worker on start (see `get_worker_state`)
+        initargs (tuple): Args of initializer
+
+    Yields:
+        tuple: (index, result)
+    """
+    if window is None:
+        window = 4 * num_processes
+
+    pool, owned = _get_pool(pool, num_processes, executor, initializer, initargs)
+    try:
+        for idx, result in _imap_chunked(pool, run_function, function_tuple_lists, ordered, window, stats, chunksize):
+            yield idx, result
+    except BaseException:
+        if owned:
+            pool.terminate()
+        raise
+    if owned:
+        pool.close()
+
+
+class TaskFailure(object):
+    """Placeholder result of a task which raised (after all retries)
+
+    Attributes:
+        index (int): Index of the task
+        error (str): repr of the exception
+        traceback (str): Formatted traceback from the worker
+        attempts (int): Number of attempts made
+    """
+
+    def __init__(self, index, error, tb, attempts):
+        self.index = index
+        self.error = error
+        self.traceback = tb
+        self.attempts = attempts
+
+    def __repr__(self):
+        return "TaskFailure(index={}, error={}, attempts={})".format(self.index, self.error, self.attempts)
+
+
+def _run_with_retries(params):
+    """Worker side: run a task, retrying with exponential backoff, never raise
+
+    Returns:
+        tuple: (bool if succeeded, result or (error repr, traceback, attempts))
+    """
+    func, task, retries, backoff = params
+    for attempt in range(1, retries + 2):
+        try:
+            return True, func(task)
+        except Exception as err:
+            failure = (repr(err), traceback.format_exc(), attempt)
+            if attempt <= retries:
+                time.sleep(backoff * 2 ** (attempt - 1))
+    return False, failure
+
+
+def _params_hash(params):
+    return hashlib.sha1(dill.dumps(params)).hexdigest()
+
+
+# Journal record: payload length and crc32, then the dill payload
+_RECORD_HEADER = struct.Struct('<II')
+
+
+def _append_record(journal, record):
+    payload = dill.dumps(record)
+    journal.write(_RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+    journal.flush()
+
+
+def _load_journal(checkpoint_file):
+    """Read all intact records of a checkpoint journal
+
+    Reading stops at the first torn or corrupt record (e.g. a crash mid-write). Its
+    offset is returned so that the caller can cut the journal there before appending.
+
+    Returns:
+        tuple: (list of (index, params hash, succeeded, result) records, byte offset after the last intact record)
+    """
+    records = list()
+    offset = 0
+    if not os.path.isfile(checkpoint_file):
+        return records, offset
+    with open(checkpoint_file, 'rb') as f:
+        while True:
+            header = f.read(_RECORD_HEADER.size)
+            if len(header) < _RECORD_HEADER.size:
+                break
+            length, checksum = _RECORD_HEADER.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            offset = f.tell()
+            try:
+                records.append(dill.loads(payload))
+            except Exception:
+                # Intact but not loadable here (e.g. result class gone), task is just run again
+                continue
+    return records, offset
+
+
+def run_functions_checkpointed(function, params_lists, checkpoint_file, num_processes=4, retries=0, backoff=1.0,
+                               window=None, verbose=False, pool=None, executor='process',
+                               initializer=None, initargs=()):
+    """Fault tolerant `run_functions_parallel` for long sweeps
+
+    Every finished task is appended to an on-disk journal as soon as it completes.
+    Re-running with the same checkpoint_file skips tasks whose params are unchanged and
+    already succeeded, so a crash or Ctrl-C only loses the tasks in flight. A task which
+    raises is retried with exponential backoff and then recorded as a TaskFailure
+    (with the worker's traceback) instead of aborting the batch. Failed tasks are
+    attempted again on the next run.
+
+    If a worker dies mid-task (os._exit, OOM kill, segfault) the pool is respawned and
+    the tasks which were in flight are run again one at a time, so the task killing its
+    worker is identified; it is retried `retries` times and then recorded as a
+    TaskFailure. Needs a WorkerPool (a raw pool would just hang on the lost task).
+
+    Args:
+        function (function): Function to run
+        params_lists (list): List of args lists (same format as `run_functions_parallel`)
+        checkpoint_file (str): Path to journal file
+        num_processes (int): Number of processes
+        retries (int): Retries per task before giving up on it
+        backoff (float): Seconds before first retry, doubled on every further retry
+        window (int): Max tasks in flight (default 4 * num_processes)
+        verbose (bool): Print progress info
+        pool (None or bool or WorkerPool): None for a fresh pool, True for the default pool
+        executor (str): 'process', 'thread' (I/O bound work), 'serial' or 'auto' (probe first task)
+        initializer (function): Run once in every worker on start (see `get_worker_state`)
+        initargs (tuple): Args of initializer
+
+    Returns:
+        list: Results in the order of params_lists, TaskFailure for tasks which failed
+    """
+    params_lists = list(params_lists)
+    hashes = [_params_hash(params_list) for params_list in params_lists]
+    results = [None] * len(params_lists)
+    done = set()
+    records, journal_size = _load_journal(checkpoint_file)
+    for idx, params_hash, ok, result in records:
+        if ok and idx < len(hashes) and hashes[idx] == params_hash:
+            results[idx] = result
+            done.add(idx)
+
+    todo = [idx for idx in range(len(params_lists)) if idx not in done]
+    if verbose:
+        print("Running {} functions parallelly ({} already done), {} at a time..".format(len(todo), len(done), num_processes))
+
+    if window is None:
+        window = 4 * num_processes
+
+    t1 = time.time()
+    num_failed = 0
+    pool, owned = _get_pool(pool, num_processes, executor, initializer, initargs)
+
+    def run_batch(indices, window):
+        """Run and journal the given tasks. Returns (in flight, never submitted) tasks if a worker died
+        """
+        nonlocal num_failed
+        submitted = list()
+        finished = set()
+
+        def tasks():
+            for idx in indices:
+                submitted.append(idx)
+                yield run_function, (function, params_lists[idx]), retries, backoff
+
+        try:
+            for pos, (ok, value) in _imap_tasks(pool, _run_with_retries, tasks(), False, window):
+                idx = indices[pos]
+                if not ok:
+                    value = TaskFailure(idx, *value)
+                    num_failed += 1
+                _append_record(journal, (idx, hashes[idx], ok, value))
+                results[idx] = value
+                finished.add(idx)
+        except WorkerLostError:
+            pool.ensure_healthy()
+            return [idx for idx in submitted if idx not in finished], indices[len(submitted):]
+        return [], []
+
+    try:
+        with open(checkpoint_file, 'ab') as journal:
+            # Drop a torn record left by a crash, otherwise everything appended after it is unreadable
+            journal.truncate(journal_size)
+            remaining = todo
+            while remaining:
+                suspects, remaining = run_batch(remaining, window)
+                # Re-run tasks lost with a dead worker alone to find the one which kills its worker
+                for idx in suspects:
+                    for attempt in range(1, retries + 2):
+                        if not run_batch([idx], 1)[0]:
+                            break
+                    else:
+                        failure = TaskFailure(idx, repr(WorkerLostError("Worker died while running the task")), '',
+                                              attempt)
+                        num_failed += 1
+                        _append_record(journal, (idx, hashes[idx], False, failure))
+                        results[idx] = failure
+    except BaseException:
+        if owned:
+            pool.terminate()
+        raise
+    if owned:
+        pool.close()
+    t2 = time.time()
+
+    total_time = t2 - t1
+
+    if verbose:
+        print("Time to run {}() function, {} times in parallel ({} failed): {} seconds or {} minutes or {} hours".format(function.__name__, len(todo), num_failed, total_time, (total_time) / 60.0, (total_time) / 3600.0))
+
+    return results
+
+
+def _split_dataframe(df, n_parts):
+    """Split dataframe into n_parts contiguous partitions of (almost) equal size
+    """
+    bounds = np.linspace(0, len(df), n_parts + 1).astype(int)
+    return [df.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def _partition_by_key(df, by, n_parts):
+    """Split dataframe into n_parts partitions such that no group of `by` is split
+
+    Groups are assigned largest first to the currently smallest partition, which
+    keeps partition sizes balanced even when group sizes are skewed.
+
+    Args:
+        df (pd.DataFrame): Dataframe
+        by (str or list): Column(s) to group by
+        n_parts (int): Number of partitions
+
+    Returns:
+        list: List of non-empty dataframe partitions (rows keep their original order)
+    """
+    # dropna=False: rows with a NaN key form their own group instead of being lost
+    group_positions = list(df.groupby(by, sort=False, dropna=False).indices.values())
+    group_positions.sort(key=len, reverse=True)
+
+    bins = [(0, part_num) for part_num in range(n_parts)]
+    part_positions = [[] for _ in range(n_parts)]
+    for positions in group_positions:
+        size, part_num = heapq.heappop(bins)
+        part_positions[part_num].append(positions)
+        heapq.heappush(bins, (size + len(positions), part_num))
+
+    return [df.iloc[np.sort(np.concatenate(positions))] for positions in part_positions if len(positions)]
+
+
+def parallelize_dataframe(df, func, n_cores=4, pool=None, shared=False, out_columns=None, by=None, reducer=None,
+                          executor='process'):
     """
     Split dataframe and apply function on given dataframe parallelly
+
+    Args:
+        df (pd.DataFrame): Dataframe
+        func (function): Function taking a dataframe partition and returning a dataframe
+        n_cores (int): Number of processes (and partitions)
+        pool (None or bool or WorkerPool): None for a fresh pool, True for the default pool
+        executor (str): 'process', 'thread' (I/O bound work), 'serial' or 'auto' (probe first task)
+        shared (bool): Pass partitions through shared memory instead of pickling them.
+            See `parallelize_dataframe_shared`
+        out_columns (list): Output columns of func (only used when shared=True)
+        by (str or list): Partition by these key column(s) so that every group lands
+            in exactly one partition (for group-wise functions)
+        reducer (function): Combines the list of partition results (default pd.concat)
+
+    Returns:
+        pd.DataFrame: Combined results
     """
-    df_split = np.array_split(df, n_cores)
-    pool = mp.Pool(n_cores)
-    df = pd.concat(pool.map(func, df_split))
-    pool.close()
-    pool.join()
+    if shared:
+        if by is not None:
+            print("Faulty input. 'by' not supported in shared mode")
+            return
+        return parallelize_dataframe_shared(df, func, n_cores, out_columns=out_columns, pool=pool, executor=executor)
+
+    if by is None:
+        df_split = _split_dataframe(df, n_cores)
+    else:
+        df_split = _partition_by_key(df, by, n_cores)
+
+    if reducer is None:
+        reducer = pd.concat
+
+    pool, owned = _get_pool(pool, n_cores, executor)
+    try:
+        df = reducer(pool.map(func, df_split))
+    except BaseException:
+        if owned:
+            pool.terminate()
+        raise
+    if owned:
+        pool.close()
     return df
 
 
-def run_commands_concurrent(cmds, num_processes=4, verbose=False, get_output=False):
+def _apply_groups(params):
+    """Worker side of `map_groups`: apply func on each group of a partition
+    """
+    func, part, by = params
+    return [(key, func(group)) for key, group in part.groupby(by, sort=False)]
+
+
+def _combine_groups(keys, values, by):
+    """Default reducer of `map_groups`, mimics the output of groupby().apply()
+    """
+    if all(isinstance(value, (pd.DataFrame, pd.Series)) for value in values):
+        names = by if isinstance(by, list) else [by]
+        return pd.concat(values, keys=keys, names=names)
+    return pd.Series(values, index=pd.Index(keys))
+
+
+def map_groups(df, by, func, n_cores=4, reducer=None, pool=None, executor='process'):
+    """Parallel groupby-apply
+
+    Rows are partitioned by key (each group goes to exactly one worker), workers run
+    func on every group of their partition and only the per-group results come back.
+
+    Args:
+        df (pd.DataFrame): Dataframe
+        by (str or list): Column(s) to group by
+        func (function): Function taking a group dataframe
+        n_cores (int): Number of processes
+        reducer (function): Called as reducer(keys, values). Defaults to concatenating
+            results like groupby().apply()
+        pool (None or bool or WorkerPool): None for a fresh pool, True for the default pool
+        executor (str): 'process', 'thread' (I/O bound work), 'serial' or 'auto' (probe first task)
+
+    Returns:
+        Output of reducer
+    """
+    if reducer is None:
+        reducer = lambda keys, values: _combine_groups(keys, values, by)
+
+    tasks = [(func, part, by) for part in _partition_by_key(df, by, n_cores)]
+    pool, owned = _get_pool(pool, n_cores, executor)
+    try:
+        part_results = pool.map(_apply_groups, tasks)
+    except BaseException:
+        if owned:
+            pool.terminate()
+        raise
+    if owned:
+        pool.close()
+
+    key_values = sorted((kv for part in part_results for kv in part), key=lambda kv: kv[0])
+    return reducer([key for key, _ in key_values], [value for _, value in key_values])
+
+
+def _close_shared_memory(shm):
+    try:
+        shm.close()
+    except BufferError:
+        # Some view on the buffer is still alive, mapping goes away with the worker
+        pass
+
+
+def _run_shared_partition(params):
+    """Worker side of `parallelize_dataframe_shared`: apply func on rows [start, end)
+    """
+    func, in_meta, out_meta, start, end, index = params
+    in_name, in_shape, in_dtype, columns = in_meta
+    out_name, out_shape, out_dtype, out_columns = out_meta
+
+    in_shm = shared_memory.SharedMemory(name=in_name)
+    out_shm = shared_memory.SharedMemory(name=out_name)
+    try:
+        in_arr = np.ndarray(in_shape, dtype=in_dtype, buffer=in_shm.buf)
+        part = pd.DataFrame(in_arr[start:end], index=index, columns=columns, copy=False)
+        res = func(part)
+        if isinstance(res, pd.DataFrame):
+            res = res[out_columns].to_numpy()
+        out_arr = np.ndarray(out_shape, dtype=out_dtype, buffer=out_shm.buf)
+        out_arr[start:end] = np.asarray(res).reshape(end - start, len(out_columns))
+        del in_arr, part, res, out_arr
+    finally:
+        _close_shared_memory(in_shm)
+        _close_shared_memory(out_shm)
+
+    return end - start
+
+
+def _shared_dtype(col):
+    """Numpy dtype a column is stored as in shared memory (None if it has none)
+
+    Nullable extension columns (Int64, Float64, boolean) use their numpy dtype, or
+    float64 (NA as NaN) if they hold missing values.
+    """
+    if not isinstance(col.dtype, pd.api.extensions.ExtensionDtype):
+        return col.dtype
+    numpy_dtype = getattr(col.dtype, 'numpy_dtype', None)
+    if numpy_dtype is None or not col.isna().any():
+        return numpy_dtype
+    return np.result_type(numpy_dtype, np.float64)
+
+
+def parallelize_dataframe_shared(df, func, n_cores=4, out_columns=None, out_dtype=np.float64, pool=None,
+                                 executor='process'):
+    """Zero-copy version of `parallelize_dataframe` for numeric dataframes
+
+    Numeric columns are copied once into a shared memory block. Workers only receive
+    the block name, a row range and the matching slice of df's index, build a dataframe
+    view on their rows and write func's output into a preallocated shared output block.
+    Only metadata and the index slices are pickled.
+
+    func must return a dataframe containing `out_columns` (or an array of shape
+    (rows, len(out_columns))) with the same number of rows as its input.
+
+    Args:
+        df (pd.DataFrame): Dataframe with numeric columns only
+        func (function): Function taking a dataframe partition
+        n_cores (int): Number of processes (and partitions)
+        out_columns (list): Columns produced by func. Defaults to the input columns
+        out_dtype (np.dtype): Dtype of output block
+        pool (None or bool or WorkerPool): None for a fresh pool, True for the default pool
+        executor (str): 'process', 'thread' (I/O bound work), 'serial' or 'auto' (probe first task)
+
+    Returns:
+        pd.DataFrame: Result with the index of df
+    """
+    columns = list(df.columns)
+    non_numeric = [col for col in columns if not pd.api.types.is_numeric_dtype(df[col])]
+    if len(non_numeric):
+        print("Faulty input. Non numeric columns not supported in shared mode: {}".format(non_numeric))
+        return
+
+    dtypes = [_shared_dtype(df.iloc[:, i]) for i in range(len(columns))]
+    unsupported = [col for col, dtype in zip(columns, dtypes) if dtype is None]
+    if len(unsupported):
+        print("Faulty input. Column dtypes without a numpy equivalent not supported in shared mode: {}".format(unsupported))
+        return
+
+    if out_columns is None:
+        out_columns = columns
+
+    in_dtype = np.result_type(*dtypes) if len(columns) else np.float64
+    in_shape = (len(df), len(columns))
+    out_shape = (len(df), len(out_columns))
+    in_shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(in_shape)) * np.dtype(in_dtype).itemsize))
+    out_shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(out_shape)) * np.dtype(out_dtype).itemsize))
+
+    pool, owned = _get_pool(pool, n_cores, executor)
+    try:
+        in_arr = np.ndarray(in_shape, dtype=in_dtype, buffer=in_shm.buf)
+        # Column by column, df.to_numpy() would build a full size temporary copy first
+        na_value = np.nan if np.dtype(in_dtype).kind == 'f' else pd.api.extensions.no_default
+        for i in range(len(columns)):
+            in_arr[:, i] = df.iloc[:, i].to_numpy(dtype=in_dtype, na_value=na_value)
+        del in_arr
+
+        in_meta = (in_shm.name, in_shape, in_dtype, columns)
+        out_meta = (out_shm.name, out_shape, out_dtype, out_columns)
+        bounds = np.linspace(0, len(df), n_cores + 1).astype(int)
+        tasks = [(func, in_meta, out_meta, start, end, df.index[start:end])
+                 for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+        pool.map(_run_shared_partition, tasks)
+
+        out_arr = np.ndarray(out_shape, dtype=out_dtype, buffer=out_shm.buf)
+        result = pd.DataFrame(out_arr.copy(), index=df.index, columns=out_columns)
+        del out_arr
+    except BaseException:
+        if owned:
+            pool.terminate()
+        raise
+    else:
+        if owned:
+            pool.close()
+    finally:
+        for shm in (in_shm, out_shm):
+            shm.close()
+            shm.unlink()
+
+    return result
+
+
+def _make_executor(executor, num_processes, initializer=None, initargs=()):
+    initargs = (initializer, tuple(initargs), None)
+    if executor == 'process':
+        return futures.ProcessPoolExecutor(max_workers=num_processes, initializer=_init_worker, initargs=initargs)
+    if executor == 'thread':
+        return futures.ThreadPoolExecutor(max_workers=num_processes, initializer=_init_worker, initargs=initargs)
+    if executor == 'serial':
+        return futures.ThreadPoolExecutor(max_workers=1, initializer=_init_worker, initargs=initargs)
+    raise ValueError("Executor '{}' not supported. Use one of {}".format(executor, EXECUTORS))
+
+
+def _executor_map(func, tasks, num_processes=4, pool=None, stats=None, executor='process', initializer=None,
+                  initargs=()):
+    """Map func over tasks with a concurrent.futures executor (or given pool), optionally instrumented
+
+    Returns:
+        list: Results in the same order as tasks
+    """
+    tasks = list(tasks)
+    if stats is not None:
+        if stats.start_time is None:
+            stats.start_time = time.time()
+        traced, ser_times = _trace_tasks(func, tasks)
+        results = _executor_map(_run_traced, traced, num_processes, pool, None, executor, initializer, initargs)
+        return [_untrace_result(res, stats, ser_time) for res, ser_time in zip(results, ser_times)]
+
+    if pool:
+        pool, _ = _get_pool(pool, num_processes, executor, initializer, initargs)
+        return _map_tasks(pool, func, tasks, 1, num_processes)
+
+    if executor == 'auto' and initializer is None and len(tasks):
+        executor, first_result = probe_executor(func, tasks[0])
+        return [first_result] + _executor_map(func, tasks[1:], num_processes, executor=executor)
+    if executor == 'auto':
+        executor = 'process'
+
+    if executor == 'serial':
+        _init_worker(initializer, initargs, None)
+        return [func(task) for task in tasks]
+
+    with _make_executor(executor, num_processes, initializer, initargs) as ex:
+        return list(ex.map(func, tasks))
+
+
+def run_commands_concurrent(cmds, num_processes=4, verbose=False, get_output=False, pool=None, stats=False,
+                            trace_file=None, executor='process'):
+    """Run shell commands with a concurrent.futures executor
+
+    Args:
+        cmds (list): Shell commands
+        num_processes (int): Number of processes
+        verbose (bool): Print timing info
+        get_output (bool): Return stdout of each command
+        pool (None or bool or WorkerPool): Run on this pool instead of a fresh executor
+        executor (str): 'process', 'thread' (I/O bound work), 'serial' or 'auto' (probe first task)
+        stats (bool or TaskStats): Collect per task instrumentation. If set, returns (results, TaskStats)
+        trace_file (str): Write per task trace events to this file (see `TaskStats.write_trace`)
+    """
     if verbose:
         print("Running {} commands, {} at a time..".format(len(cmds), num_processes))
 
     t1 = time.time()
-    with futures.ProcessPoolExecutor(max_workers=num_processes) as ex:
-        if get_output:
-            results = ex.map(get_command_output, cmds)
-        else:
-            results = ex.map(run_command, cmds)
+    task_stats = _get_stats(stats, trace_file)
+    results = _executor_map(get_command_output if get_output else run_command, cmds, num_processes, pool, task_stats, executor)
+    _finish_stats(task_stats, trace_file)
     t2 = time.time()
 
     total_time = t2 - t1
@@ -122,20 +1885,42 @@ def run_commands_concurrent(cmds, num_processes=4, verbose=False, get_output=Fal
     if verbose:
         print("Time to run {} commands: {} seconds or {} minutes or {} hours".format(len(cmds), total_time, (total_time) / 60.0, (total_time) / 3600.0))
 
+    if stats:
+        return (results if get_output else None), task_stats
+
     if get_output:
         return list(results)
     else:
         return
 
 
-def run_functions_concurrent(function, params_lists, num_processes=4, verbose=False):
+def run_functions_concurrent(function, params_lists, num_processes=4, verbose=False, pool=None, stats=False,
+                             trace_file=None, executor='process', initializer=None, initargs=()):
+    """Run function for each params list with a concurrent.futures executor
+
+    Args:
+        function (function): Function to run
+        params_lists (list): List of args lists (same format as `run_functions_parallel`)
+        num_processes (int): Number of processes
+        verbose (bool): Print timing info
+        pool (None or bool or WorkerPool): Run on this pool instead of a fresh executor
+        executor (str): 'process', 'thread' (I/O bound work), 'serial' or 'auto' (probe first task)
+        stats (bool or TaskStats): Collect per task instrumentation. If set, returns (results, TaskStats)
+        trace_file (str): Write per task trace events to this file (see `TaskStats.write_trace`)
+        initializer (function): Run once in every worker on start (see `get_worker_state`)
+        initargs (tuple): Args of initializer
+
+    Returns:
+        list: Results in the order of params_lists
+    """
     if verbose:
         print("Running {} functions parallelly, {} at a time..".format(len(params_lists), num_processes))
 
     t1 = time.time()
     iterable = [(function, params_list) for params_list in params_lists]
-    with futures.ProcessPoolExecutor(max_workers=num_processes) as ex:
-        results = ex.map(run_function, iterable)
+    task_stats = _get_stats(stats, trace_file)
+    results = _executor_map(run_function, iterable, num_processes, pool, task_stats, executor, initializer, initargs)
+    _finish_stats(task_stats, trace_file)
     t2 = time.time()
 
     total_time = t2 - t1
@@ -143,16 +1928,120 @@ def run_functions_concurrent(function, params_lists, num_processes=4, verbose=Fa
     if verbose:
         print("Time to run {}() function, {} times in parallel: {} seconds or {} minutes or {} hours".format(function.__name__, len(params_lists), total_time, (total_time) / 60.0, (total_time) / 3600.0))
 
+    if stats:
+        return list(results), task_stats
+
     return list(results)
 
 
-def run_mult_functions_concurrent(function_tuple_lists, num_processes=4, verbose=False):
+def imap_functions_concurrent(function, params_lists, num_processes=4, ordered=True, window=None, stats=None,
+                              executor='process', initializer=None, initargs=()):
+    """Streaming version of `run_functions_concurrent` (as_completed style)
+
+    Args:
+        function (function): Function to run
+        params_lists (iterable): Parameters for each call
+        num_processes (int): Number of processes
+        ordered (bool): Yield results in input order or as they complete
+        window (int): Max tasks in flight (default 4 * num_processes)
+        stats (TaskStats): Collect per task instrumentation into this object while iterating
+        executor (str): 'process', 'thread' (I/O bound work), 'serial' or 'auto' (probe first task)
+        initializer (function): Run once in every worker on start (see `get_worker_state`)
+        initargs (tuple): Args of initializer
+
+    Yields:
+        tuple: (index, result)
+    """
+    if window is None:
+        window = 4 * num_processes
+    ser_times = dict()
+    if stats is not None and stats.start_time is None:
+        stats.start_time = time.time()
+
+    iterable = enumerate((function, params_list) for params_list in params_lists)
+    exhausted = False
+    pending = dict()
+    buffered = dict()
+    next_to_yield = 0
+
+    if executor == 'auto' and initializer is not None:
+        # Probing would run the initializer in the calling process
+        executor = 'process'
+    if executor == 'auto':
+        first = next(iterable, None)
+        if first is None:
+            return
+        idx, task = first
+        if stats is not None:
+            (traced,), (ser_time,) = _trace_tasks(run_function, [task], [idx])
+            executor, result = probe_executor(_run_traced, traced)
+            result = _untrace_result(result, stats, ser_time)
+        else:
+            executor, result = probe_executor(run_function, task)
+        yield idx, result
+        next_to_yield = 1
+
+    with _make_executor(executor, num_processes, initializer, initargs) as ex:
+        while True:
+            while not exhausted and len(pending) + len(buffered) < window:
+                try:
+                    idx, task = next(iterable)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if stats is not None:
+                    (traced,), (ser_times[idx],) = _trace_tasks(run_function, [task], [idx])
+                    pending[ex.submit(_run_traced, traced)] = idx
+                else:
+                    pending[ex.submit(run_function, task)] = idx
+
+            if len(pending) == 0:
+                break
+
+            done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for fut in done:
+                idx = pending.pop(fut)
+                result = fut.result()
+                if stats is not None:
+                    result = _untrace_result(result, stats, ser_times.pop(idx))
+                    stats.end_time = time.time()
+
+                if not ordered:
+                    yield idx, result
+                    continue
+
+                buffered[idx] = result
+                while next_to_yield in buffered:
+                    yield next_to_yield, buffered.pop(next_to_yield)
+                    next_to_yield += 1
+
+
+def run_mult_functions_concurrent(function_tuple_lists, num_processes=4, verbose=False, pool=None, stats=False,
+                                  trace_file=None, executor='process', initializer=None, initargs=()):
+    """Run different functions with a concurrent.futures executor
+
+    Args:
+        function_tuple_lists (list): List of (function, args list) tuples
+        num_processes (int): Number of processes
+        verbose (bool): Print timing info
+        pool (None or bool or WorkerPool): Run on this pool instead of a fresh executor
+        executor (str): 'process', 'thread' (I/O bound work), 'serial' or 'auto' (probe first task)
+        stats (bool or TaskStats): Collect per task instrumentation. If set, returns (results, TaskStats)
+        trace_file (str): Write per task trace events to this file (see `TaskStats.write_trace`)
+        initializer (function): Run once in every worker on start (see `get_worker_state`)
+        initargs (tuple): Args of initializer
+
+    Returns:
+        list: Results in the order of function_tuple_lists
+    """
     if verbose:
         print("Running {} functions parallelly, {} at a time..".format(len(function_tuple_lists), num_processes))
 
     t1 = time.time()
-    with futures.ProcessPoolExecutor(max_workers=num_processes) as ex:
-        results = ex.map(run_function, function_tuple_lists)
+    task_stats = _get_stats(stats, trace_file)
+    results = _executor_map(run_function, function_tuple_lists, num_processes, pool, task_stats, executor, initializer,
+                            initargs)
+    _finish_stats(task_stats, trace_file)
     t2 = time.time()
 
     total_time = t2 - t1
@@ -160,4 +2049,148 @@ def run_mult_functions_concurrent(function_tuple_lists, num_processes=4, verbose
     if verbose:
         print("Time to run mult functions, {} times in parallel: {} seconds or {} minutes or {} hours".format(len(function_tuple_lists), total_time, (total_time) / 60.0, (total_time) / 3600.0))
 
+    if stats:
+        return list(results), task_stats
+
     return list(results)
+
+
+CommandResult = namedtuple('CommandResult', ['cmd', 'returncode', 'stdout', 'stderr', 'attempts', 'elapsed'])
+
+
+async def _read_stream(stream, cmd, lines, on_output):
+    while True:
+        line = await stream.readline()
+        if not line:
+            break
+        line = line.decode('utf-8', errors='replace')
+        lines.append(line)
+        if on_output is not None:
+            on_output(cmd, line.rstrip('\n'))
+
+
+async def _run_command_async(cmd, semaphore, timeout=None, retries=0, retry_delay=1.0, on_output=None, index=0, stats=None):
+    """Run one shell command as an asyncio subprocess, retrying on failure
+
+    Returns:
+        CommandResult: returncode is None if the last attempt timed out
+    """
+    submit_time = time.time()
+    async with semaphore:
+        t1 = time.time()
+        for attempt in range(1, retries + 2):
+            # New session so that a timeout can kill the shell and all its children
+            proc = await asyncio.create_subprocess_shell(cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                                                         start_new_session=True)
+            out_lines, err_lines = list(), list()
+            try:
+                await asyncio.wait_for(asyncio.gather(_read_stream(proc.stdout, cmd, out_lines, on_output),
+                                                      _read_stream(proc.stderr, cmd, err_lines, None),
+                                                      proc.wait()), timeout)
+                returncode = proc.returncode
+            except asyncio.TimeoutError:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                await proc.wait()
+                returncode = None
+
+            if returncode == 0 or attempt == retries + 1:
+                break
+            await asyncio.sleep(retry_delay * attempt)
+
+    t2 = time.time()
+    result = CommandResult(cmd, returncode, ''.join(out_lines), ''.join(err_lines), attempt, t2 - t1)
+    if stats is not None:
+        stats.add(dict(index=index, pid=proc.pid, submit=submit_time, start=t1, end=t2, queue_wait=t1 - submit_time,
+                       run_time=t2 - t1, args_bytes=len(cmd.encode('utf-8')), args_ser_time=0.0, args_deser_time=0.0,
+                       result_bytes=len(result.stdout.encode('utf-8')), result_ser_time=0.0, result_deser_time=0.0))
+    return result
+
+
+async def _run_commands_async(cmds, max_concurrency, timeout, retries, retry_delay, on_output, stats=None):
+    semaphore = asyncio.Semaphore(max_concurrency)
+    return await asyncio.gather(*[_run_command_async(cmd, semaphore, timeout, retries, retry_delay, on_output, idx, stats)
+                                  for idx, cmd in enumerate(cmds)])
+
+
+def _run_coroutine(coro):
+    """Run coroutine to completion, also from inside a running event loop (e.g. jupyter)
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    result = dict()
+
+    def target():
+        try:
+            result['value'] = asyncio.run(coro)
+        except BaseException as err:
+            result['error'] = err
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+
+def run_commands_async(cmds, max_concurrency=16, timeout=None, retries=0, retry_delay=1.0, verbose=False,
+                       get_output=False, return_results=False, on_output=None, stats=False, trace_file=None):
+    """Run shell commands concurrently with asyncio subprocesses (no process pool)
+
+    Much cheaper than `run_command_parallel` for many short commands, since no python
+    worker processes are forked; only the commands themselves are spawned.
+
+    Args:
+        cmds (list): Shell commands
+        max_concurrency (int): Max commands running at a time
+        timeout (float): Per-command timeout in seconds (per attempt)
+        retries (int): Number of retries for a command which failed or timed out
+        retry_delay (float): Seconds to wait before a retry (multiplied by attempt number)
+        verbose (bool): Print timing info
+        get_output (bool): Return stripped stdout of each command, like `run_command_parallel`.
+            Raises sp.CalledProcessError if a command failed
+        return_results (bool): Return list of CommandResult (cmd, returncode, stdout, stderr, attempts, elapsed)
+        on_output (function): Called as on_output(cmd, line) for each stdout line as it is produced
+        stats (bool or TaskStats): Collect per command instrumentation (pid is the command's pid).
+            If set, returns (results, TaskStats)
+        trace_file (str): Write per command trace events to this file (see `TaskStats.write_trace`)
+
+    Returns:
+        None or list
+    """
+    if verbose:
+        print("Running {} commands, {} at a time..".format(len(cmds), max_concurrency))
+
+    t1 = time.time()
+    task_stats = _get_stats(stats, trace_file)
+    if task_stats is not None and task_stats.start_time is None:
+        task_stats.start_time = t1
+    results = _run_coroutine(_run_commands_async(cmds, max_concurrency, timeout, retries, retry_delay, on_output, task_stats))
+    _finish_stats(task_stats, trace_file)
+    t2 = time.time()
+
+    total_time = t2 - t1
+
+    if verbose:
+        num_failed = len([res for res in results if res.returncode != 0])
+        print("Time to run {} commands ({} failed): {} seconds or {} minutes or {} hours".format(len(cmds), num_failed, total_time, (total_time) / 60.0, (total_time) / 3600.0))
+
+    if return_results:
+        output = results
+    elif get_output:
+        for res in results:
+            if res.returncode != 0:
+                raise sp.CalledProcessError(res.returncode if res.returncode is not None else -9, res.cmd, res.stdout, res.stderr)
+        output = [res.stdout.strip() for res in results]
+    else:
+        output = None
+
+    if stats:
+        return output, task_stats
+    return output
@@ -14,6 +14,132 @@ import numpy as np
 pyo.init_notebook_mode()
 
 
+DEFAULT_MAX_POINTS = 20000
+WEBGL_THRESHOLD = 20000
+DOWNSAMPLE_METHODS = ['minmax', 'lttb']
+
+
+def _to_numeric(x):
+    """Float positions for x values (datetimes as ns, non numeric values by position)
+    """
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64) or np.issubdtype(x.dtype, np.timedelta64):
+        return x.astype('int64').astype(float)
+    if np.issubdtype(x.dtype, np.number):
+        return x.astype(float)
+    return np.arange(len(x), dtype=float)
+
+
+def _numeric_values(y):
+    """Float values of y (datetimes as ns, NaT as NaN), None if y is not numeric (e.g. labels)
+    """
+    y = np.asarray(y)
+    if np.issubdtype(y.dtype, np.datetime64) or np.issubdtype(y.dtype, np.timedelta64):
+        values = y.astype('int64').astype(float)
+        values[np.isnat(y)] = np.nan
+        return values
+    if np.issubdtype(y.dtype, np.number) or y.dtype == bool:
+        return y.astype(float)
+    if y.dtype == object:
+        try:
+            return y.astype(float)
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+def _bucket_edges(n, num_buckets, start=0, stop=None):
+    stop = n if stop is None else stop
+    return np.linspace(start, stop, num_buckets + 1).astype(int)
+
+
+def downsample_minmax(x, y, max_points):
+    """Indices of the min and max point of every bucket (keeps the visual envelope and all spikes)
+
+    Args:
+        x (array): X values (only the length is used)
+        y (array): Y values
+        max_points (int): Number of points to keep (about)
+
+    Returns:
+        np.ndarray: Sorted indices of kept points (all of them if y is not numeric)
+    """
+    n = len(y)
+    y = _numeric_values(y)
+    if n <= max_points or y is None:
+        return np.arange(n)
+
+    edges = _bucket_edges(n, max(1, (max_points - 2) // 2))
+    indices = [0, n - 1]
+    for start, stop in zip(edges[:-1], edges[1:]):
+        bucket = y[start:stop]
+        if not len(bucket):
+            continue
+        if np.isnan(bucket).all():
+            # Keep one point so gaps stay visible
+            indices.append(start)
+            continue
+        indices.append(start + np.nanargmin(bucket))
+        indices.append(start + np.nanargmax(bucket))
+    return np.unique(indices)
+
+
+def downsample_lttb(x, y, max_points):
+    """Largest-Triangle-Three-Buckets downsampling (keeps the visual shape of a line)
+
+    Args:
+        x (array): X values (numbers or datetimes)
+        y (array): Y values
+        max_points (int): Number of points to keep
+
+    Returns:
+        np.ndarray: Sorted indices of kept points (all of them if y is not numeric)
+    """
+    n = len(y)
+    y = _numeric_values(y)
+    if n <= max_points or y is None:
+        return np.arange(n)
+    if max_points < 3:
+        return np.array([0, n - 1])[:max_points]
+    x = _to_numeric(x)
+
+    edges = _bucket_edges(n, max_points - 2, 1, n - 1)
+    indices = np.zeros(max_points, dtype=int)
+    indices[-1] = n - 1
+    prev = 0
+    for i in range(max_points - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_start, next_stop = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        if next_start >= next_stop:
+            next_start, next_stop = n - 1, n
+        # Average of the next bucket is the third corner of the triangle
+        avg_x = x[next_start:next_stop].mean()
+        avg_y = np.nanmean(y[next_start:next_stop]) if not np.isnan(y[next_start:next_stop]).all() else y[prev]
+        areas = np.abs((x[prev] - avg_x) * (y[start:stop] - y[prev]) - (x[prev] - x[start:stop]) * (avg_y - y[prev]))
+        prev = start + (np.nanargmax(areas) if not np.isnan(areas).all() else 0)
+        indices[i + 1] = prev
+    return indices
+
+
+def downsample(x, y, max_points=DEFAULT_MAX_POINTS, method='minmax'):
+    """Reduce a series to about max_points points for plotting
+
+    Args:
+        x (array): X values
+        y (array): Y values
+        max_points (int): Target number of points
+        method (str): 'minmax' (min/max envelope per bucket) or 'lttb' (Largest-Triangle-Three-Buckets)
+
+    Returns:
+        np.ndarray: Sorted indices of points to keep
+    """
+    if method == 'minmax':
+        return downsample_minmax(x, y, max_points)
+    if method == 'lttb':
+        return downsample_lttb(x, y, max_points)
+    raise ValueError("Downsample method '{}' not supported. Use one of {}".format(method, DOWNSAMPLE_METHODS))
+
+
 def get_plotly_yaxes(given_yaxes, start_num=0):
     """List of Y-Axis classes for a plot
 
@@ -32,7 +158,8 @@ def get_plotly_yaxes(given_yaxes, start_num=0):
 
 
 def plotly_plot(xs, ys, names, modes=[], yaxes=[], line_styles=[], texts=[], line_shapes=[], height=700, 
-                width=500, title='', return_fig=False, return_traces=False, autosize=True):
+                width=500, title='', return_fig=False, return_traces=False, autosize=True,
+                max_points=DEFAULT_MAX_POINTS, downsample_method='minmax', webgl=None):
     """Plotly plot for any number of xs, ys
 
     Args:
@@ -49,6 +176,10 @@ def plotly_plot(xs, ys, names, modes=[], yaxes=[], line_styles=[], texts=[], lin
         return_fig (bool): Return plotly figure object or not
         return_traces (bool): Return list of traces instead of plotting
         autosize (bool): Autosize width of plot
+        max_points (int): Downsample traces with more points to about this many (None to plot all points)
+        downsample_method (str): 'minmax' (keeps extremes) or 'lttb' (keeps shape), see `downsample`
+        webgl (bool): Use WebGL (go.Scattergl) traces. None to use them for traces with more than
+            WEBGL_THRESHOLD points
 
     Example:
         yaxes = [0, 0, 1, 1, 2] will mean that 
@@ -84,6 +215,10 @@ def plotly_plot(xs, ys, names, modes=[], yaxes=[], line_styles=[], texts=[], lin
         print("Faulty input. Size mismatch between xs (or ys) and line_shapes")
         return
 
+    if downsample_method not in DOWNSAMPLE_METHODS:
+        print("Faulty input. Downsample method '{}' not supported".format(downsample_method))
+        return
+
     # Get y-axes
     if len(yaxes) == 0:
         yaxes = ['y1' for _ in xs]
@@ -108,12 +243,24 @@ def plotly_plot(xs, ys, names, modes=[], yaxes=[], line_styles=[], texts=[], lin
     
     traces = list()
     for x, y, name, mode, yax, line_style, txt, line_shape in zip(xs, ys, names, modes, yaxes, line_styles, texts, line_shapes):
+        if max_points is not None and len(y) > max_points:
+            idx = downsample(x, y, max_points, downsample_method)
+            # Non numeric y (labels) is not downsampled
+            if len(idx) < len(y):
+                if len(txt) == len(y):
+                    txt = np.asarray(txt)[idx]
+                x, y = np.asarray(x)[idx], np.asarray(y)[idx]
+
+        use_webgl = webgl if webgl is not None else len(y) > WEBGL_THRESHOLD
+        scatter = go.Scattergl if use_webgl else go.Scatter
+        # WebGL traces support step shapes but not splines
+        shape_kwargs = dict(line_shape=line_shape) if not use_webgl or line_shape != 'spline' else dict()
         if yax != 'y1':
-            traces.append(go.Scatter(x=x, y=y, mode=mode, name=name, yaxis=yax, line={
-                          'dash': line_style}, text=txt, line_shape=line_shape))
+            traces.append(scatter(x=x, y=y, mode=mode, name=name, yaxis=yax, line={
+                          'dash': line_style}, text=txt, **shape_kwargs))
         else:
-            traces.append(go.Scatter(x=x, y=y, mode=mode, name=name, line={
-                          'dash': line_style}, text=txt, line_shape=line_shape))
+            traces.append(scatter(x=x, y=y, mode=mode, name=name, line={
+                          'dash': line_style}, text=txt, **shape_kwargs))
 
     if return_traces:
         return traces
@@ -173,7 +320,8 @@ def plotly_plot(xs, ys, names, modes=[], yaxes=[], line_styles=[], texts=[], lin
 
 
 def plotly_columns(df, columns, names=None, date=None, stime=None, etime=None, modes=[], yaxes=[], line_styles=[], texts=[], 
-                   line_shapes=[], height=700, width=500, title='', return_fig=False, return_traces=False, autosize=True):
+                   line_shapes=[], height=700, width=500, title='', return_fig=False, return_traces=False, autosize=True,
+                   max_points=DEFAULT_MAX_POINTS, downsample_method='minmax', webgl=None):
     """
     Plot given column of dataframe
 
@@ -195,6 +343,9 @@ def plotly_columns(df, columns, names=None, date=None, stime=None, etime=None, m
         return_fig (bool): Return plotly figure object or not
         return_traces (bool): Return list of traces instead of plotting
         autosize (bool): Autosize width of plot
+        max_points (int): Downsample columns with more rows to about this many points (None to plot all rows)
+        downsample_method (str): 'minmax' (keeps extremes) or 'lttb' (keeps shape)
+        webgl (bool): Use WebGL (go.Scattergl) traces. None to decide by number of points
     """
     if date is not None and stime is not None and etime is not None:
         tmp_df = time_slice(df, date, stime, etime)
@@ -206,7 +357,8 @@ def plotly_columns(df, columns, names=None, date=None, stime=None, etime=None, m
     if names is None:
         names = columns
         
-    return plotly_plot(xs, ys, names, modes, yaxes, line_styles, texts, line_shapes, height, width, title, return_fig, return_traces, autosize)
+    return plotly_plot(xs, ys, names, modes, yaxes, line_styles, texts, line_shapes, height, width, title, return_fig, return_traces, autosize,
+                       max_points, downsample_method, webgl)
 
 
 def plotly_traces(traces, height=700, width=500, autosize=True, yaxes=[], title="", return_fig=False):
@@ -1,9 +1,40 @@
 import datetime, json, os, errno
 import sys
+import re
+import hashlib
+from collections.abc import Mapping
 import subprocess as sp
 import gzip
+import bz2
+import lzma
+import io
+import queue
+import threading
+import tempfile
+import mmap
+import struct
+import shutil
+import itertools
+from concurrent import futures
 import pickle as pkl
 
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+try:
+    from isal import igzip, igzip_threaded
+except ImportError:
+    igzip = igzip_threaded = None
+
 
 def flush_output(stuff, print_time=False):
     if not print_time:
@@ -27,71 +58,297 @@ def silent_remove(filename):
         if e.errno != errno.ENOENT: # errno.ENOENT = no such file or directory
             raise # re-raise exception if a different error occurred
 
+def _copy_file_range(fsrc, fdst):
+    """Kernel side copy (no data through user space, reflinks on CoW filesystems)
+    """
+    size = os.fstat(fsrc.fileno()).st_size
+    offset = 0
+    while offset < size:
+        copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset)
+        if copied == 0:
+            break
+        offset += copied
+    return offset
+
+
+def copy_file(src, dst):
+    """Copy file contents and permission bits in process (like `cp src dst`)
+
+    Uses `os.copy_file_range` where available and falls back to `shutil.copyfile`
+    (which itself uses `sendfile` on Linux). Raises `shutil.SameFileError` if dst
+    is src, without touching the file.
+
+    Args:
+        src (str): Path to file
+        dst (str): Path to new file or to an existing directory
+
+    Returns:
+        str: Path of the copy
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        raise shutil.SameFileError("'{}' and '{}' are the same file".format(src, dst))
+    copied = False
+    if hasattr(os, 'copy_file_range'):
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            try:
+                copied = _copy_file_range(fsrc, fdst) == os.fstat(fsrc.fileno()).st_size
+            except OSError:
+                copied = False
+    if not copied:
+        shutil.copyfile(src, dst)
+    shutil.copymode(src, dst)
+    return dst
+
+
 def silent_copy(infile, outfile):
-    os.system(f'cp {infile} {outfile}')
+    try:
+        copy_file(infile, outfile)
+    except OSError as e:
+        print("Could not copy '{}' to '{}': {}".format(infile, outfile, e))
 
 
 def copy_file_to_directory(file_path, dir_path):
     if not os.path.isdir(dir_path):
         print("Given directory path is not a directory..")
-        cmd = 'mkdir -p {}'.format(dir_path)
-        os.system(cmd)
+        mkdirs(dir_path)
         print("Created directory for - '{}'".format(dir_path))
 
-    cmd = 'cp {} {}'.format(file_path, dir_path)
-    os.system(cmd)
+    silent_copy(file_path, dir_path)
     return
 
 
-def read_lines(file_name):
-    if not file_name.endswith(".gz"):
-        with open(file_name, 'r') as f:
-            lines = [l.strip() for l in f.readlines() if len(l.strip())]
-    else:
-        with gzip.open(file_name, 'rt') as f:
-            lines = [l.strip() for l in f.readlines() if len(l.strip())]
+BUFFER_SIZE = 1 << 20
+
+
+COMPRESSION_MAGIC = [
+    (b'\x1f\x8b', 'gzip'),
+    # 'BZh', block size digit, then the magic of the first block (or of the end of an empty stream)
+    (re.compile(rb'BZh[1-9](1AY&SY|\x17rE8P\x90)'), 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+    (b'\x04\x22\x4d\x18', 'lz4'),
+]
+COMPRESSION_EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz', '.zst': 'zstd', '.zstd': 'zstd', '.lz4': 'lz4'}
 
-    return lines
 
+def detect_compression(file_name, mode='r'):
+    """Detect compression of a file from its magic bytes, falling back to its extension
 
-def write_lines(lines, file_name, mode='w'):
-    if not os.path.isfile(file_name):
-        cmd = "touch {}".format(file_name)
-        _ = os.system(cmd)
+    Args:
+        file_name (str): Path to file
+        mode (str): Open mode. Files opened for writing ('w') only use the extension
+
+    Returns:
+        str: One of 'gzip', 'bz2', 'xz', 'zstd', 'lz4' or None for uncompressed files
+    """
+    if 'w' not in mode and os.path.isfile(file_name):
+        with open(file_name, 'rb') as f:
+            head = f.read(16)
+        for magic, compression in COMPRESSION_MAGIC:
+            if magic.match(head) if isinstance(magic, re.Pattern) else head.startswith(magic):
+                return compression
+        if head:
+            return None
+    return COMPRESSION_EXTENSIONS.get(os.path.splitext(file_name.strip())[1].lower())
+
+
+class _ReadAheadReader(io.RawIOBase):
+    """Decompress in a background thread while the caller parses the previous chunks
+
+    Codecs release the GIL while decompressing, so this overlaps decompression
+    with line splitting for the single threaded stdlib codecs.
+    """
 
-    if mode == 'w':
-        with open(file_name, 'w') as f:
-            f.write('\n'.join([str(line) for line in lines])+'\n')
-    elif mode == 'a':
-        curr_lines = read_lines(file_name)
-        write_lines(curr_lines + lines, file_name)
+    def __init__(self, stream, chunk_size=BUFFER_SIZE, prefetch=4):
+        super().__init__()
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._chunks = queue.Queue(maxsize=prefetch)
+        self._stop = threading.Event()
+        self._pending = b''
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _fill(self):
+        try:
+            while not self._stop.is_set():
+                chunk = self._stream.read(self._chunk_size)
+                self._chunks.put(chunk)
+                if not chunk:
+                    return
+        except Exception as e:
+            self._chunks.put(e)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._pending:
+            chunk = self._chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if not chunk:
+                self._chunks.put(chunk)
+                return 0
+            self._pending = chunk
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            while self._thread.is_alive():
+                try:
+                    self._chunks.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self._stream.close()
+        super().close()
+
+
+def _require(module, name, package):
+    if module is None:
+        raise ImportError("Reading/writing {} files needs the '{}' package".format(name, package))
+
+
+def _open_compressed(file_name, mode, compression, threads=None):
+    """Open compressed file in binary mode ('rb', 'wb' or 'ab')
+    """
+    reading = 'r' in mode
+    if compression == 'gzip':
+        if threads and igzip_threaded is not None:
+            return igzip_threaded.open(file_name, mode, threads=threads)
+        stream = (igzip or gzip).open(file_name, mode)
+    elif compression == 'bz2':
+        stream = bz2.open(file_name, mode)
+    elif compression == 'xz':
+        stream = lzma.open(file_name, mode)
+    elif compression == 'zstd':
+        _require(zstandard, 'zstd', 'zstandard')
+        fh = open(file_name, mode)
+        if reading:
+            return zstandard.ZstdDecompressor().stream_reader(fh, read_across_frames=True, closefd=True)
+        cctx = zstandard.ZstdCompressor(threads=threads or 0)
+        return cctx.stream_writer(fh, closefd=True, write_return_read=True)
+    elif compression == 'lz4':
+        _require(lz4_frame, 'lz4', 'lz4')
+        stream = lz4_frame.open(file_name, mode)
     else:
+        raise ValueError("Compression '{}' not supported".format(compression))
+
+    if reading and threads:
+        return _ReadAheadReader(stream, prefetch=2 * threads)
+    return stream
+
+
+def _open_text(file_name, mode, buffer_size=BUFFER_SIZE, threads=None, compression='auto'):
+    """Open plain or compressed file in text mode with a large read/write buffer
+
+    compression='auto' detects it (see `detect_compression`), None forces a plain file
+    """
+    if compression == 'auto':
+        compression = detect_compression(file_name, mode)
+    if compression is None:
+        return open(file_name, mode.replace('t', ''), buffering=buffer_size)
+    raw = _open_compressed(file_name, mode.replace('t', '') + 'b', compression, threads)
+    if 'r' in mode:
+        raw = io.BufferedReader(raw, buffer_size)
+    return io.TextIOWrapper(raw)
+
+
+def iter_lines(file_name, strip=True, skip_empty=True, buffer_size=BUFFER_SIZE, threads=None):
+    """Lazily iterate over lines of a plain or compressed file in constant memory
+
+    Args:
+        file_name (str): Path to file (compression is detected, see `get_io_wrapper`)
+        strip (bool): Strip whitespace around each line
+        skip_empty (bool): Skip blank lines
+        buffer_size (int): Size of chunks read from disk
+        threads (int): Decompress with this many threads (None for inline decompression)
+
+    Yields:
+        str: Lines of the file
+    """
+    with _open_text(file_name, 'rt', buffer_size, threads) as f:
+        for line in f:
+            if strip:
+                line = line.strip()
+            elif line.endswith('\n'):
+                line = line[:-1]
+            if skip_empty and not line.strip():
+                continue
+            yield line
+
+
+def read_lines(file_name, threads=None):
+    return list(iter_lines(file_name, threads=threads))
+
+
+def _ends_with_newline(file_name):
+    if detect_compression(file_name) is not None or not os.path.getsize(file_name):
+        return True
+    with open(file_name, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+def write_lines(lines, file_name, mode='w', compression='auto'):
+    """Write lines (any iterable, consumed lazily) to a plain or compressed file
+
+    Args:
+        lines (iterable): Items to write, one per line
+        file_name (str): Path to file
+        mode (str): 'w' to overwrite, 'a' to append to the end of the file without reading it
+        compression (str): 'auto' to pick it from the extension (or the existing file when
+            appending), None for plain text, or one of 'gzip', 'bz2', 'xz', 'zstd', 'lz4'
+    """
+    if mode not in ('w', 'a'):
         print("Given mode '{}' not supported".format(mode))
+        return
+
+    prefix = ''
+    if mode == 'a' and os.path.isfile(file_name) and not _ends_with_newline(file_name):
+        prefix = '\n'
+
+    with _open_text(file_name, mode + 't', compression=compression) as f:
+        f.write(prefix)
+        for line in lines:
+            f.write(str(line) + '\n')
 
     return
 
 
-def get_io_wrapper(file_name, mode=None):
+def get_io_wrapper(file_name, mode=None, threads=None):
     """Get Wrapper to read a file name line by line. Useful to pass to functions which need all lines from a file
 
+    gzip, bz2, xz, zstd and lz4 files are decompressed transparently. Compression
+    is detected from the magic bytes of the file (extension for new files). zstd
+    and lz4 need the optional 'zstandard'/'lz4' packages; gzip uses python-isal
+    when installed.
+
     Args:
         file_name (str): Path to file
         mode (str): Mode (usually 'r' or 'rt' or 'rb')
+        threads (int): Threads used for (de)compression. Multi-threaded with isal (gzip)
+            and zstandard (zstd writes), otherwise decompression runs ahead in a background thread
 
     Returns:
         _io.TextIOWrapper 
     """
-    if file_name.strip().endswith('.gz'):
-        if mode is None:
-            mode = 'rt'
-
-        return gzip.open(file_name, mode)
-    else:
-        if mode is None:
-            mode = 'r'
-
+    if mode is None:
+        mode = 'r'
+    compression = detect_compression(file_name, mode)
+    if compression is None:
         return open(file_name, mode)
 
+    if 'b' in mode:
+        return _open_compressed(file_name, mode.replace('b', '') + 'b', compression, threads)
+    return _open_text(file_name, mode.replace('t', '') + 't', threads=threads)
+
 
 def get_command_output(cmd):
     """
@@ -126,16 +383,26 @@ def flatten(list_of_lists):
     Returns:
         list: Flattened list
     """
-    return [x for each_list in list_of_lists for x in each_list]
+    return list(iter_flatten(list_of_lists))
+
+
+def iter_flatten(list_of_lists):
+    """Lazily flatten an iterable of iterables (works on generators)
+
+    Args:
+        list_of_lists (iterable): Iterable of iterables
+
+    Returns:
+        iterator: Items of all inner iterables
+    """
+    return itertools.chain.from_iterable(list_of_lists)
 
 
 def create_directory(dir_name):
     """Create directory
     """
     try:
-        # _ = os.mkdir(dir_name)
-        cmd = f"mkdir -p {dir_name}"
-        _ = os.system(cmd)
+        os.makedirs(dir_name, exist_ok=True)
         return
     except Exception:
         return 
@@ -152,59 +419,266 @@ def copy_file_to_dir(file_name, dir_name):
     """
     create_directory(dir_name)
     
-    cmd = "cp {} {}".format(file_name, dir_name)
-    os.system(cmd)
+    silent_copy(file_name, dir_name)
     
     return os.path.join(dir_name, os.path.basename(file_name))
 
 
-def copy_files_to_dir(files, dir_name):
+def _copy_with_status(file_name, dir_name):
+    dst = os.path.join(dir_name, os.path.basename(file_name))
+    try:
+        copy_file(file_name, dst)
+        return dst, None
+    except OSError as e:
+        return dst, e
+
+
+def copy_files_to_dir(files, dir_name, num_threads=8, return_status=False):
     """Copy multiple files to directory
+
+    Copies run in a thread pool (file copies release the GIL), no processes are spawned.
+
+    Args:
+        files (list): Paths to files
+        dir_name (str): Path to directory (created if needed)
+        num_threads (int): Number of concurrent copies
+        return_status (bool): Also return the error (None on success) of every file
+
+    Returns:
+        list: New file paths, or (new file path, error) tuples if return_status
     """
-    return [copy_file_to_dir(file_name, dir_name) for file_name in files]
+    create_directory(dir_name)
+    with futures.ThreadPoolExecutor(max_workers=num_threads) as ex:
+        statuses = list(ex.map(lambda file_name: _copy_with_status(file_name, dir_name), files))
+
+    if return_status:
+        return statuses
+    for file_name, (_, error) in zip(files, statuses):
+        if error is not None:
+            print("Could not copy '{}' to '{}': {}".format(file_name, dir_name, error))
+    return [dst for dst, _ in statuses]
 
 
 def remove_lines_from_file(file_name, substring):
     """Remove all lines from give file which contain given substring
 
+    Streams the file into a temporary file next to it which then replaces the
+    original, so memory use does not depend on file size.
+
     Args:
         file_name (str): Path to file
         substring (str): Substring to search in file
     """
-    lines = [x for x in read_lines(file_name) if substring not in x]
-    write_lines(lines, file_name)
+    dir_name = os.path.dirname(os.path.abspath(file_name))
+    compression = detect_compression(file_name)
+    fd, tmp_name = tempfile.mkstemp(dir=dir_name)
+    os.close(fd)
+    try:
+        write_lines((x for x in iter_lines(file_name) if substring not in x), tmp_name, compression=compression)
+        os.chmod(tmp_name, os.stat(file_name).st_mode & 0o7777)
+        os.replace(tmp_name, file_name)
+    except BaseException:
+        silent_remove(tmp_name)
+        raise
     return
 
 
 def add_lines_to_file(file_name, new_lines):
-    """Add given line to end of file
+    """Add given line to end of file (appends in place, existing lines are not read)
 
     Args:
         file_name (str): Path to file
-        new_lines (list): List of strings to add at the end of file
+        new_lines (iterable): Strings to add at the end of file
     """
     write_lines(new_lines, file_name, mode='a')
     return
 
+def _freeze(item):
+    """Hashable stand-in for common unhashable items (tagged with the type so e.g. [1] != (1,))
+    """
+    if isinstance(item, (list, tuple)):
+        return type(item).__name__, tuple(_freeze(x) for x in item)
+    if isinstance(item, dict):
+        return 'dict', frozenset((k, _freeze(v)) for k, v in item.items())
+    if isinstance(item, set):
+        return 'set', frozenset(item)
+    if isinstance(item, np.ndarray):
+        return 'ndarray', item.dtype.str, item.shape, item.tobytes()
+    hash(item)
+    return item
+
+
 def remove_duplicates(any_list):
     """Remove duplicates without changing order of items
 
+    Runs in O(n) using a set of seen items. Unhashable items (lists, dicts, sets,
+    arrays) are compared through a hashable copy, anything else that cannot be
+    hashed falls back to a linear scan over the other unhashable items.
+
     Args:
-        any_list (list): List of items
+        any_list (iterable): Items
 
     Returns:
         list: List without duplicates
     """
 
     final_list = list()
+    seen = set()
+    seen_unhashable = list()
     for item in any_list:
-        if item not in final_list:
+        try:
+            key = _freeze(item)
+        except TypeError:
+            if item not in seen_unhashable:
+                seen_unhashable.append(item)
+                final_list.append(item)
+            continue
+        if key not in seen:
+            seen.add(key)
             final_list.append(item)
 
     return final_list
 
 
-def load_map_from_file(file_name, sep=' '):
+def _iter_map_items(file_name, sep=' '):
+    for line in iter_lines(file_name):
+        tokens = [x.strip() for x in line.strip().split(sep) if len(x.strip())]
+        yield tokens[0], float(tokens[1])
+
+
+def _key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+
+class _KeyTable(object):
+    """Sorted byte string keys stored as one blob plus offsets
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        return self.blob[self.offsets[idx]:self.offsets[idx + 1]].tobytes()
+
+
+class CompiledMap(Mapping):
+    """Read-only str -> float map backed by numpy arrays (see `load_map_from_file`)
+
+    Keys are kept sorted in a single byte blob with offsets next to a float64
+    value array. Lookups binary search a sorted array of 64 bit key hashes
+    (`np.searchsorted`) and then compare the key itself. When loaded from a
+    sidecar file the arrays are memory mapped, so loading is instant and pages
+    are only read on access.
+    """
+
+    def __init__(self, blob, offsets, values, hashes=None, hash_order=None):
+        self._keys = _KeyTable(blob, offsets)
+        self.values_array = values
+        if hashes is None:
+            hashes = np.array([_key_hash(self._keys[i]) for i in range(len(self._keys))], dtype=np.uint64)
+            hash_order = np.argsort(hashes, kind='stable')
+            hashes = hashes[hash_order]
+        self._hashes = hashes
+        self._hash_order = hash_order
+
+    @classmethod
+    def from_items(cls, items):
+        keys, values = list(), list()
+        for key, value in items:
+            keys.append(key.encode('utf-8'))
+            values.append(value)
+        keys = np.array(keys, dtype=object)
+        values = np.array(values, dtype=np.float64)
+
+        # Stable sort, then keep the last occurrence of repeated keys (same as dict)
+        order = np.argsort(keys, kind='stable')
+        keys, values = keys[order], values[order]
+        if len(keys):
+            last = np.append(keys[1:] != keys[:-1], True)
+            keys, values = keys[last], values[last]
+
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(k) for k in keys])
+        blob = np.frombuffer(b''.join(keys), dtype=np.uint8)
+        return cls(blob, offsets, values)
+
+    def _index(self, key):
+        key = key.encode('utf-8')
+        key_hash = _key_hash(key)
+        pos = int(np.searchsorted(self._hashes, np.uint64(key_hash)))
+        while pos < len(self._hashes) and self._hashes[pos] == key_hash:
+            idx = int(self._hash_order[pos])
+            if self._keys[idx] == key:
+                return idx
+            pos += 1
+        return -1
+
+    def get_many(self, keys, default=np.nan):
+        """Vectorized lookup of many keys
+
+        Returns:
+            np.ndarray: float64 values (default for missing keys)
+        """
+        keys = [key.encode('utf-8') for key in keys]
+        hashes = np.array([_key_hash(key) for key in keys], dtype=np.uint64)
+        positions = np.searchsorted(self._hashes, hashes)
+        result = np.full(len(keys), default, dtype=np.float64)
+        for i, pos in enumerate(positions.tolist()):
+            while pos < len(self._hashes) and self._hashes[pos] == hashes[i]:
+                idx = int(self._hash_order[pos])
+                if self._keys[idx] == keys[i]:
+                    result[i] = self.values_array[idx]
+                    break
+                pos += 1
+        return result
+
+    def __getitem__(self, key):
+        idx = self._index(key)
+        if idx < 0:
+            raise KeyError(key)
+        return float(self.values_array[idx])
+
+    def __contains__(self, key):
+        return self._index(key) >= 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        for idx in range(len(self._keys)):
+            yield self._keys[idx].decode('utf-8')
+
+    def to_dict(self):
+        return dict(zip(self, self.values_array.tolist()))
+
+    def save(self, file_path, source_stat=None, sep=None):
+        """Store arrays (out-of-band pickle, so they can be memory mapped on load)
+
+        source_stat and sep describe the source file the map was built from.
+        """
+        tmp_path = file_path + '.tmp{}'.format(os.getpid())
+        store_data(dict(blob=self._keys.blob, offsets=self._keys.offsets, values=self.values_array,
+                        hashes=self._hashes, hash_order=self._hash_order, source_stat=source_stat, sep=sep),
+                   tmp_path, fmt='pickle5')
+        os.replace(tmp_path, file_path)
+
+    @classmethod
+    def load(cls, file_path, mmap_mode='r'):
+        data = load_data(file_path, mmap_mode=mmap_mode)
+        file_map = cls(data['blob'], data['offsets'], data['values'], data['hashes'], data['hash_order'])
+        return file_map, data['source_stat'], data.get('sep')
+
+
+def _source_stat(file_name):
+    stat = os.stat(file_name)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_map_from_file(file_name, sep=' ', compiled=False, sidecar=None):
     """Load data into map from given file.
 
     Expects file to be in the format
@@ -215,43 +689,229 @@ def load_map_from_file(file_name, sep=' '):
     ...
     '
 
+    With compiled=True a `CompiledMap` is returned instead of a dict. It is
+    built once and saved to a sidecar file which later calls memory map
+    (rebuilt whenever the source file or sep changes). This is much faster to reload
+    and much smaller than a dict for maps with millions of entries.
+
     Args:
         file_name (str): Path to file
+        sep (str): Separator between key and value
+        compiled (bool): Return a memory mapped `CompiledMap`
+        sidecar (str): Path of compiled file (defaults to file_name + '.cmap')
 
     Returns:
-        dict: Mapping loaded from file
+        dict or CompiledMap: Mapping loaded from file
     """
-    lines = read_lines(file_name)
+    if not compiled:
+        return dict(_iter_map_items(file_name, sep))
+
+    if sidecar is None:
+        sidecar = file_name + '.cmap'
+    source_stat = _source_stat(file_name)
+    if os.path.isfile(sidecar):
+        file_map, stored_stat, stored_sep = CompiledMap.load(sidecar)
+        if stored_stat == source_stat and stored_sep == sep:
+            return file_map
+
+    CompiledMap.from_items(_iter_map_items(file_name, sep)).save(sidecar, source_stat, sep)
+    file_map, _, _ = CompiledMap.load(sidecar)
+    return file_map
 
-    file_map = dict()
-    for line in lines:
-        tokens = [x.strip() for x in line.strip().split(sep) if len(x.strip())]
-        file_map[tokens[0]] = float(tokens[1])
+_OOB_MAGIC = b'PKLOOB5\n'
+_OOB_ALIGN = 64
 
-    return file_map
 
-def store_data(data, file_path):
+def _is_plain_file(f):
+    return isinstance(f, io.BufferedReader) and isinstance(f.raw, io.FileIO)
+
+
+def _dump_pickle(data, f, compression=None):
+    pkl.dump(data, f, protocol=pkl.HIGHEST_PROTOCOL)
+
+
+def _load_pickle(f, mmap_mode=None):
+    return pkl.load(f)
+
+
+def _dump_pickle_oob(data, f, compression=None):
+    """Pickle protocol 5 with out-of-band buffers
+
+    Layout: magic, payload size, number of buffers, buffer sizes, pickle payload
+    and then the raw buffers (e.g. array data), each aligned to 64 bytes.
     """
-    Store data in pickle file
+    buffers = list()
+    payload = pkl.dumps(data, protocol=5, buffer_callback=buffers.append)
+    raws = [b.raw() for b in buffers]
+    header = _OOB_MAGIC + struct.pack('<QQ', len(payload), len(raws))
+    header += struct.pack('<{}Q'.format(len(raws)), *[r.nbytes for r in raws])
+    f.write(header)
+    f.write(payload)
+    pos = len(header) + len(payload)
+    for raw in raws:
+        pad = -pos % _OOB_ALIGN
+        f.write(b'\0' * pad)
+        f.write(raw)
+        pos += pad + raw.nbytes
+
+
+def _load_pickle_oob(f, mmap_mode=None):
+    if mmap_mode is not None:
+        access = {'r': mmap.ACCESS_READ, 'c': mmap.ACCESS_COPY, 'r+': mmap.ACCESS_WRITE}[mmap_mode]
+        view = memoryview(mmap.mmap(f.fileno(), 0, access=access))
+    elif _is_plain_file(f):
+        # Single read straight into a writable buffer, arrays become views on it
+        view = memoryview(bytearray(os.fstat(f.fileno()).st_size))
+        f.readinto(view)
+    else:
+        view = memoryview(bytearray(f.read()))
+
+    pos = len(_OOB_MAGIC)
+    payload_size, n_buffers = struct.unpack_from('<QQ', view, pos)
+    pos += 16
+    sizes = struct.unpack_from('<{}Q'.format(n_buffers), view, pos)
+    pos += 8 * n_buffers
+    payload = view[pos:pos + payload_size]
+    pos += payload_size
+    buffers = list()
+    for size in sizes:
+        pos += -pos % _OOB_ALIGN
+        buffers.append(view[pos:pos + size])
+        pos += size
+    return pkl.loads(payload, buffers=buffers)
+
+
+def _is_plain_array(data):
+    return isinstance(data, np.ndarray) and data.dtype != object
+
+
+def _fits_numpy_format(data, fmt):
+    """npy/npz can only hold (non object) arrays, npz also a dict of them
+    """
+    if fmt == 'npy':
+        return _is_plain_array(data)
+    if isinstance(data, dict):
+        return all(isinstance(k, str) for k in data) and all(_is_plain_array(v) for v in data.values())
+    return _is_plain_array(data)
+
+
+def _dump_npy(data, f, compression=None):
+    np.save(f, data)
+
+
+def _load_npy(f, mmap_mode=None):
+    if mmap_mode is not None:
+        return np.load(f.name, mmap_mode=mmap_mode)
+    if _is_plain_file(f):
+        return np.load(f)
+    return np.load(io.BytesIO(f.read()))
+
+
+def _dump_npz(data, f, compression=None):
+    if not isinstance(data, dict):
+        data = {'arr_0': data}
+    if compression:
+        np.savez_compressed(f, **data)
+    else:
+        np.savez(f, **data)
+
+
+def _load_npz(f, mmap_mode=None):
+    source = f.name if _is_plain_file(f) else io.BytesIO(f.read())
+    with np.load(source) as npz:
+        data = dict(npz)
+    # A single array was stored under the default name
+    if list(data) == ['arr_0']:
+        return data['arr_0']
+    return data
+
+
+SERIAL_FORMATS = dict()
+SERIAL_EXTENSIONS = dict()
+
+
+def register_format(name, dump, load, magic=None, extensions=()):
+    """Register a serialization format for `store_data`/`load_data`
+
+    Args:
+        name (str): Format name (used as `fmt` argument)
+        dump (function): dump(data, f, compression) writing to binary file object f
+        load (function): load(f, mmap_mode) reading from binary file object f. mmap_mode
+            is only given for uncompressed files
+        magic (bytes): Leading bytes of files in this format (for auto detection on load)
+        extensions (tuple): File extensions which select this format on store
+    """
+    SERIAL_FORMATS[name] = dict(dump=dump, load=load, magic=magic)
+    for ext in extensions:
+        SERIAL_EXTENSIONS[ext] = name
+
+
+register_format('pickle', _dump_pickle, _load_pickle, b'\x80', ('.pkl', '.pickle'))
+register_format('pickle5', _dump_pickle_oob, _load_pickle_oob, _OOB_MAGIC, ('.pkl5',))
+register_format('npy', _dump_npy, _load_npy, b'\x93NUMPY', ('.npy',))
+register_format('npz', _dump_npz, _load_npz, b'PK\x03\x04', ('.npz',))
+
+
+def _format_from_magic(head):
+    for name, serial_format in SERIAL_FORMATS.items():
+        magic = serial_format['magic']
+        if magic and head.startswith(magic):
+            return name
+    return 'pickle'
+
+
+def store_data(data, file_path, fmt=None, compression=None, threads=None):
+    """
+    Store data in file (pickle by default)
     Args:
         data: data to be stored
         file_path: file name
+        fmt: One of SERIAL_FORMATS. None to choose from the extension (pickle for unknown ones):
+            'pickle': plain pickle, highest protocol
+            'pickle5': pickle protocol 5 with array buffers stored out-of-band (fast, mmap-able loads)
+            'npy': single numpy array
+            'npz': numpy array or dict of numpy arrays
+            Data npy/npz cannot hold (e.g. lists, object arrays) is stored as pickle instead
+        compression: None or one of 'gzip', 'bz2', 'xz', 'zstd', 'lz4' (see `get_io_wrapper`)
+        threads: Compression threads
     """
-    f = open(file_path, 'wb')
-    pkl.dump(data, f)
-    f.close()
+    if fmt is None:
+        ext = os.path.splitext(file_path)[1].lower()
+        fmt = SERIAL_EXTENSIONS.get(ext, 'pickle')
+    if fmt not in SERIAL_FORMATS:
+        print("Given format '{}' not supported".format(fmt))
+        return
+    if fmt in ('npy', 'npz') and not _fits_numpy_format(data, fmt):
+        fmt = 'pickle'
+
+    dump = SERIAL_FORMATS[fmt]['dump']
+    if compression is None or fmt == 'npz':
+        with open(file_path, 'wb') as f:
+            dump(data, f, compression)
+    else:
+        with _open_compressed(file_path, 'wb', compression, threads) as f:
+            dump(data, f, compression)
     return
-    
-def load_data(file_path):
+
+
+def load_data(file_path, mmap_mode=None, threads=None):
     """
-    Load data from given file
+    Load data from given file. Format and compression are detected from the file contents
     Args:
         file_path: file name
+        mmap_mode: None to read into memory. 'r' (read-only), 'c' (copy-on-write) or 'r+' to
+            memory map uncompressed 'npy'/'pickle5' files, so arrays are loaded lazily without copies
+        threads: Decompression threads
     """
-    f = open(file_path, 'rb')
-    data = pkl.load(f)
-    f.close()
-    return data
+    compression = detect_compression(file_path)
+    if compression is None:
+        f = open(file_path, 'rb')
+    else:
+        f = io.BufferedReader(_open_compressed(file_path, 'rb', compression, threads))
+        mmap_mode = None
+    with f:
+        fmt = _format_from_magic(f.peek(16)[:16])
+        return SERIAL_FORMATS[fmt]['load'](f, mmap_mode)
 
     
 def divide_into_chunks(array, chunk_size):
@@ -264,4 +924,30 @@ def divide_into_chunks(array, chunk_size):
     Returns:
         list or str or tuple: List of chunks
     """
-    return [array[i:i + chunk_size] for i in range(0, len(array), chunk_size)] 
+    return list(iter_chunks(array, chunk_size))
+
+
+def iter_chunks(iterable, chunk_size):
+    """Lazily divide an iterable into pieces of a given size
+
+    Containers are sliced (NumPy arrays give views, nothing is copied), any other
+    iterable (e.g. a generator) is consumed chunk by chunk into lists.
+
+    Args:
+        iterable (iterable): Container or iterator
+        chunk_size (int): Size of each piece (except possibly the last one)
+
+    Yields:
+        Chunks of the same type as the container, lists for iterators
+    """
+    if hasattr(iterable, '__getitem__') and hasattr(iterable, '__len__'):
+        for i in range(0, len(iterable), chunk_size):
+            yield iterable[i:i + chunk_size]
+        return
+
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk 